@@ -0,0 +1,233 @@
+# catalogapp/analytics.py
+"""
+Federated analytics: one merge operator per `analytics_key`.
+
+run_analytics fans the tagged catalog query out to every endpoint, turns
+each answer into a frame (SPARQL bindings, or the plain JSON object of
+delegated analytics) and concatenates them with columnar.merge; the
+operator registered for the key then reduces that single merged frame,
+vectorized, into the JSON payload returned to the browser.
+
+An operator may also reduce each endpoint's answer while it streams in
+(`parse`), as `quantiles` does: the bindings are folded into a bounded
+quantile sketch and never held in memory.
+
+Adding an analytic means tagging its template with an `analytics_key` and
+registering an operator for it:
+
+    register('myKey', sum_by('group', 'n'))
+"""
+import re
+from dataclasses import dataclass, replace
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import decoding
+from .columnar import numeric
+from .federation import PLAIN_JSON, SPARQL_JSON
+from .sketch import TDigest
+
+
+@dataclass(frozen=True)
+class Operator:
+    """
+    `merge(frame)` reduces the merged answers of all endpoints (their
+    variables plus a categorical `endpoint` column) to a JSON-ready dict.
+    With `delegate`, the node computes the analytic itself: it is sent the
+    analytics_key and answers a plain JSON object, one frame row per node.
+    `parse(resp)`, if given, turns an endpoint's streamed response straight
+    into its frame (see federation.fan_out).
+    """
+    merge:    Callable[[pd.DataFrame], dict]
+    delegate: bool = False
+    parse:    Optional[Callable] = None
+
+    @property
+    def accept(self):
+        return PLAIN_JSON if self.delegate else SPARQL_JSON
+
+
+_REGISTRY = {}
+
+
+def register(key, merge, delegate=False):
+    """
+    Register the merge operator of `analytics_key` `key`; `merge` is either
+    a function of the merged frame or an Operator.
+    """
+    if isinstance(merge, Operator):
+        _REGISTRY[key] = replace(merge, delegate=delegate or merge.delegate)
+    else:
+        _REGISTRY[key] = Operator(merge, delegate)
+
+
+def get(key):
+    """Operator registered for `key`, or None."""
+    return _REGISTRY.get(key)
+
+
+def keys():
+    """All registered analytics keys."""
+    return tuple(_REGISTRY)
+
+
+def _groups(frame, by):
+    return [frame[c].astype(object).where(frame[c].notna(), None) for c in by]
+
+
+def _records(frame, columns):
+    out = frame[columns].astype(object)
+    return out.where(out.notna(), None).to_dict('records')
+
+
+def _natural(label):
+    """
+    Sort key of bucket labels such as '<40', '40–60', '>60': their first
+    number, '<' before a range starting there and '>' after it.
+    """
+    label = str(label)
+    m = re.search(r'\d+(?:\.\d+)?', label)
+    return (float(m.group()) if m else 0.0, {'<': -1, '>': 1}.get(label[:1], 0))
+
+
+# ---- operators --------------------------------------------------------------
+
+def sum_by(by, *values, order=None):
+    """
+    Sum the `values` columns per `by` group (a column name or a list of them)
+    across all endpoints: {'results': [{by…, value…}, …]}. `order` sorts the
+    groups by a key function of the (first) group label; default: as seen.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+
+    def merge(frame):
+        if frame.empty:
+            return {'results': []}
+        sums = (pd.DataFrame({v: numeric(frame[v]).fillna(0) for v in values})
+                  .groupby(_groups(frame, by), sort=False, dropna=False).sum()
+                  .reset_index())
+        sums.columns = by + list(values)
+        if order is not None:
+            sums = sums.sort_values(by[0], key=lambda labels: labels.map(order), kind='stable')
+        return {'results': _records(sums, by + list(values))}
+    return merge
+
+
+def count_by(by):
+    """Number of answer rows per `by` group: {'results': [{by…, 'n'}, …]}."""
+    by = [by] if isinstance(by, str) else list(by)
+
+    def merge(frame):
+        if frame.empty:
+            return {'results': []}
+        counts = frame.groupby(_groups(frame, by), sort=False, dropna=False).size().reset_index()
+        counts.columns = by + ['n']
+        return {'results': _records(counts, by + ['n'])}
+    return merge
+
+
+def histogram(bucket, count):
+    """
+    Merge per-node histograms: add the `count` of identical `bucket` labels,
+    buckets in numeric order ({'results': [{bucket, count}, …]}).
+    """
+    return sum_by(bucket, count, order=_natural)
+
+
+def weighted_mean(value, weight, by=()):
+    """
+    Mean of per-node means `value` weighted by their `weight` (e.g. row
+    counts), per `by` group if given:
+    {'results': [{by…, value: mean, weight: total weight}, …]}.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+
+    def merge(frame):
+        if frame.empty:
+            return {'results': []}
+        w = numeric(frame[weight]).fillna(0).astype('float64')
+        v = numeric(frame[value]).astype('float64')
+        parts = pd.DataFrame({'vw': (v * w).where(v.notna(), 0), 'w': w.where(v.notna(), 0)})
+        if by:
+            parts = parts.groupby(_groups(frame, by), sort=False, dropna=False).sum()
+            out = parts.reset_index()
+            out.columns = by + ['vw', 'w']
+        else:
+            out = parts.sum().to_frame().T
+        out[value]  = (out['vw'] / out['w']).where(out['w'] > 0)
+        out[weight] = out['w']
+        return {'results': _records(out, by + [value, weight])}
+    return merge
+
+
+def per_node(*fields):
+    """The nodes' own values, side by side: {'results': [{'endpoint', field…}, …]}."""
+    def merge(frame):
+        columns = ['endpoint'] + [f for f in fields if f in frame.columns]
+        return {'results': _records(frame, columns)}
+    return merge
+
+
+def quantiles(value, qs=(0.05, 0.25, 0.5, 0.75, 0.95), compression=100, chunk=4096):
+    """
+    Federated quantiles (median, percentiles) of the `value` variable.
+
+    Each endpoint's bindings are streamed into a TDigest as they are parsed,
+    `chunk` values at a time, so memory is bounded by the sketch size and
+    not by the number of patients; the per-node digests are then merged.
+    Registered with delegate=True, the nodes build the sketch themselves
+    and answer {"sketch": TDigest.to_dict()} (no parse then).
+    {'results': [{'quantile', 'value'}, …], 'n': …,
+     'per_node': [{'endpoint', 'n', 'quantiles': {q: value}}, …]}
+    """
+    def parse(resp):
+        resp.raw.decode_content = True
+        data = decoding.iter_sparql(resp.raw)
+        if 'results' not in data:
+            raise ValueError("not a SPARQL SELECT answer")
+        digest, batch = TDigest(compression), []
+        for bd in data['results']['bindings']:
+            cell = bd.get(value)
+            if cell is not None:
+                batch.append(cell.get('value'))
+            if len(batch) >= chunk:
+                digest.update(pd.to_numeric(pd.Series(batch, dtype=object), errors='coerce'))
+                batch = []
+        digest.update(pd.to_numeric(pd.Series(batch, dtype=object), errors='coerce'))
+        # plain data: the answer may be shared by concurrent requests (single flight)
+        return pd.DataFrame({'sketch': [digest.to_dict()]})
+
+    def merge(frame):
+        total = TDigest(compression)
+        per_node = []
+        for name, sketch in zip(frame['endpoint'], frame['sketch']) if len(frame) else ():
+            digest = TDigest.from_dict(sketch)
+            per_node.append({
+                'endpoint':  name,
+                'n':         int(digest.count),
+                'quantiles': {str(q): _number(v) for q, v in zip(qs, digest.quantiles(qs))},
+            })
+            total.merge(digest)
+        return {
+            'results':  [{'quantile': q, 'value': _number(v)}
+                         for q, v in zip(qs, total.quantiles(qs))],
+            'n':        int(total.count),
+            'per_node': per_node,
+        }
+
+    return Operator(merge, parse=parse)
+
+
+def _number(v):
+    return None if np.isnan(v) else float(v)
+
+
+# ---- registry ---------------------------------------------------------------
+
+register('ageDist',    histogram('bracket', 'n'))
+register('klDiv',      per_node('kl_divergence'), delegate=True)
+register('ageOnStats', sum_by(['evType', 'sex'], 'n', 'sum', 'sumSq'))
+register('survivalQuantiles', quantiles('diff'))
+register('ageOnQuantiles',    quantiles('ageOn'))
@@ -0,0 +1,137 @@
+# catalogapp/breaker.py
+"""
+Per-endpoint circuit breakers for the federated fan-out.
+
+  closed    – calls go through; BREAKER_FAILURE_THRESHOLD consecutive
+              failures open the breaker
+  open      – calls are skipped right away, for BREAKER_RESET_TIMEOUT seconds
+              (or until the health monitor sees the node back up)
+  half-open – a single trial call is let through; its outcome closes
+              or re-opens the breaker
+
+Each breaker also keeps the latencies of recent successful calls, used to
+derive an adaptive per-endpoint timeout from their p95. They are kept per
+template: an ASK answered in 50 ms says nothing about how long the same
+node takes to send a level-6 dump.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+CLOSED    = 'closed'
+OPEN      = 'open'
+HALF_OPEN = 'half-open'
+
+
+class EndpointUnavailable(Exception):
+    """Raised (as an EndpointResult error) for calls skipped by an open breaker."""
+
+    def __str__(self):
+        return 'skipped (unhealthy)'
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, window=50):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout     = reset_timeout
+        self.state     = CLOSED
+        self.failures  = 0
+        self.opened_at = None
+        self.window    = window
+        self.latencies = {}   # template -> deque of recent latencies
+        self._trial    = False
+        self._lock     = threading.Lock()
+
+    def allow(self):
+        """May a call go out now? (claims the trial slot when half-open)"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self, latency=None, template=None):
+        with self._lock:
+            self.state    = CLOSED
+            self.failures = 0
+            self._trial   = False
+            if latency is not None:
+                window = self.latencies.get(template)
+                if window is None:
+                    window = self.latencies[template] = deque(maxlen=self.window)
+                window.append(latency)
+
+    def release(self):
+        """A call ended with no outcome to record (its caller gave up): free the trial slot."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial    = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state     = OPEN
+                self.opened_at = time.monotonic()
+
+    def record_probe(self, online):
+        """
+        Health-monitor feedback: a node seen down counts as a failure,
+        a node seen up gets a trial call instead of waiting out the reset timeout.
+        """
+        if not online:
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state == OPEN:
+                self.state = HALF_OPEN
+
+    def p95(self, template=None):
+        with self._lock:
+            ordered = sorted(self.latencies.get(template, ()))
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def timeout(self, default, template=None):
+        """
+        Adaptive timeout: a multiple of the p95 latency observed for
+        `template`, never above `default` and never below BREAKER_MIN_TIMEOUT;
+        `default` until we have enough samples of that template.
+        """
+        with self._lock:
+            samples = len(self.latencies.get(template, ()))
+        if samples < getattr(settings, 'BREAKER_MIN_SAMPLES', 10):
+            return default
+        adaptive = self.p95(template) * getattr(settings, 'BREAKER_TIMEOUT_FACTOR', 4)
+        return min(default, max(getattr(settings, 'BREAKER_MIN_TIMEOUT', 1), adaptive))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(ep):
+    """The process-wide breaker of an endpoint (keyed by its primary key)."""
+    with _breakers_lock:
+        breaker = _breakers.get(ep.pk)
+        if breaker is None:
+            breaker = _breakers[ep.pk] = CircuitBreaker(
+                failure_threshold=getattr(settings, 'BREAKER_FAILURE_THRESHOLD', 3),
+                reset_timeout=getattr(settings, 'BREAKER_RESET_TIMEOUT', 30),
+                window=getattr(settings, 'BREAKER_WINDOW', 50),
+            )
+        return breaker
+
+
+def reset(endpoint_id):
+    """Forget an endpoint's history, e.g. after it was edited."""
+    with _breakers_lock:
+        _breakers.pop(endpoint_id, None)
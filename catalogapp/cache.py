@@ -0,0 +1,184 @@
+# catalogapp/cache.py
+"""
+Cache of per-endpoint federated answers.
+
+An answer is keyed on (template hash, normalized parameters, endpoint id)
+and lives for a TTL that depends on the template level, so cheap aggregate
+answers (level 0–2) can be kept longer than row dumps (level 5–6).
+Two backends are available:
+  • 'memory' – an in-process LRU, lost on restart
+  • 'duckdb' – a DuckDB file next to ALLOWED_DB, which survives restarts
+    (used by one worker process; the others keep their answers in memory)
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_TTL = {0: 3600, 1: 3600, 2: 3600, 3: 900, 4: 900, 5: 300, 6: 300}
+
+
+def normalize_params(params):
+    """Canonical text form of the parameters, independent of order and stray blanks."""
+    return json.dumps(
+        {k: (v.strip() if isinstance(v, str) else v) for k, v in (params or {}).items()},
+        sort_keys=True, ensure_ascii=False,
+    )
+
+
+def cache_key(template_hash, params, endpoint_id):
+    return f"{template_hash}:{normalize_params(params)}:{endpoint_id}"
+
+
+class MemoryBackend:
+    """Size-bounded LRU dict: key -> (endpoint_id, expires_at, value)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[2]
+
+    def set(self, key, endpoint_id, value, ttl):
+        with self._lock:
+            self._data[key] = (endpoint_id, time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, endpoint_id=None):
+        with self._lock:
+            if endpoint_id is None:
+                self._data.clear()
+                return
+            for key in [k for k, item in self._data.items() if item[0] == endpoint_id]:
+                del self._data[key]
+
+
+class DuckDBBackend:
+    """
+    Same interface, persisted in a DuckDB table.
+    DuckDB allows one writer per file: with several worker processes, only
+    the first one to open RESULT_CACHE_DB uses it (see get_result_cache).
+    """
+
+    def __init__(self, path, max_entries):
+        import duckdb
+
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._con = duckdb.connect(path)
+        self._con.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                key         VARCHAR PRIMARY KEY,
+                endpoint_id INTEGER,
+                expires_at  DOUBLE,
+                last_used   DOUBLE,
+                value       VARCHAR
+            )
+        """)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._con.execute(
+                "SELECT value FROM result_cache WHERE key = ? AND expires_at >= ?",
+                [key, now]
+            ).fetchone()
+            if row is None:
+                return None
+            self._con.execute("UPDATE result_cache SET last_used = ? WHERE key = ?", [now, key])
+        return json.loads(row[0])
+
+    def set(self, key, endpoint_id, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._con.execute(
+                "INSERT OR REPLACE INTO result_cache VALUES (?, ?, ?, ?, ?)",
+                [key, endpoint_id, now + ttl, now, json.dumps(value)]
+            )
+            # drop expired entries, then the least recently used beyond the bound
+            self._con.execute("DELETE FROM result_cache WHERE expires_at < ?", [now])
+            self._con.execute("""
+                DELETE FROM result_cache WHERE key IN (
+                    SELECT key FROM result_cache ORDER BY last_used DESC OFFSET ?
+                )
+            """, [self.max_entries])
+
+    def invalidate(self, endpoint_id=None):
+        with self._lock:
+            if endpoint_id is None:
+                self._con.execute("DELETE FROM result_cache")
+            else:
+                self._con.execute("DELETE FROM result_cache WHERE endpoint_id = ?", [endpoint_id])
+
+
+class ResultCache:
+    """Level-aware front end over one of the backends above."""
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl     = {**DEFAULT_TTL, **(ttl or {})}
+
+    def get(self, entry, params, ep):
+        return self.backend.get(cache_key(entry['hash'], params, ep.pk))
+
+    def set(self, entry, params, ep, value):
+        ttl = self.ttl.get(entry['level'])
+        if ttl:
+            self.backend.set(cache_key(entry['hash'], params, ep.pk), ep.pk, value, ttl)
+
+    def invalidate(self, endpoint_id=None):
+        """Forget everything cached for one endpoint, or for all of them."""
+        self.backend.invalidate(endpoint_id)
+
+
+_cache      = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    The process-wide ResultCache configured by RESULT_CACHE_* settings,
+    or None when caching is disabled. A process that can't open the DuckDB
+    file (another worker holds it) falls back to the memory backend.
+    """
+    global _cache
+    kind = getattr(settings, 'RESULT_CACHE_BACKEND', 'memory')
+    if not kind:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            max_entries = getattr(settings, 'RESULT_CACHE_MAX_ENTRIES', 1000)
+            if kind == 'duckdb':
+                path = getattr(settings, 'RESULT_CACHE_DB', None) or os.path.join(
+                    os.path.dirname(settings.ALLOWED_DB), 'result_cache.duckdb')
+                import duckdb
+                try:
+                    backend = DuckDBBackend(path, max_entries)
+                except duckdb.IOException as ex:
+                    print("RESULT CACHE: in memory in this process:", ex)
+                    backend = MemoryBackend(max_entries)
+            else:
+                backend = MemoryBackend(max_entries)
+            _cache = ResultCache(backend, getattr(settings, 'RESULT_CACHE_TTL', None))
+        return _cache
+
+
+def invalidate(endpoint_id=None):
+    cache = get_result_cache()
+    if cache is not None:
+        cache.invalidate(endpoint_id)
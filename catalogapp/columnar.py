@@ -0,0 +1,202 @@
+# catalogapp/columnar.py
+"""
+Columnar handling of SPARQL SELECT results.
+
+Each endpoint's `results.bindings` becomes one pandas DataFrame (one column
+per projected variable), and merging endpoints is a single concatenation
+with the endpoint identity stored once, as a categorical column, instead of
+being copied into a dict per row.
+
+Literal values are decoded once, here, from their `datatype` annotation
+(xsd:integer, xsd:decimal, xsd:date, xsd:boolean, …) into native column
+dtypes, so downstream code never re-parses strings.
+"""
+import numpy as np
+import pandas as pd
+
+from . import decoding
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+
+INTEGER_TYPES = {XSD + t for t in (
+    'integer', 'int', 'long', 'short', 'byte',
+    'nonNegativeInteger', 'positiveInteger', 'nonPositiveInteger', 'negativeInteger',
+    'unsignedLong', 'unsignedInt', 'unsignedShort', 'unsignedByte',
+)}
+FLOAT_TYPES    = {XSD + t for t in ('decimal', 'double', 'float')}
+DATE_TYPES     = {XSD + t for t in ('date', 'dateTime', 'dateTimeStamp')}
+BOOLEAN_TYPES  = {XSD + 'boolean'}
+
+
+def decode_column(values, datatypes):
+    """
+    Typed Series for one variable: `values` are the lexical forms (None when
+    unbound) and `datatypes` the set of datatype IRIs seen in that column.
+    Columns with no or mixed datatypes stay strings.
+    """
+    column = pd.Series(values, dtype=object)
+    if len(datatypes) != 1:
+        return column
+    datatype = next(iter(datatypes))
+    if datatype in INTEGER_TYPES:
+        numbers = pd.to_numeric(column, errors='coerce')
+        # a malformed "integer" (e.g. 2.5) is missing, like any other bad literal
+        return numbers.where(numbers % 1 == 0).astype('Int64')
+    if datatype in FLOAT_TYPES:
+        return pd.to_numeric(column, errors='coerce').astype('float64')
+    if datatype == XSD + 'date':
+        # the optional timezone of an xsd:date doesn't move the day
+        return pd.to_datetime(column.str.replace(r'(Z|[+-]\d\d:\d\d)$', '', regex=True),
+                              errors='coerce', format='ISO8601')
+    if datatype in DATE_TYPES:
+        # ISO8601 rather than a format guessed from the first value, so
+        # fractional seconds or offsets appearing later aren't lost
+        return pd.to_datetime(column, errors='coerce', utc=True, format='ISO8601')
+    if datatype in BOOLEAN_TYPES:
+        return column.map({'true': True, '1': True, 'false': False, '0': False}).astype('boolean')
+    return column
+
+
+def frame_from_sparql(data, typed=True):
+    """
+    DataFrame of one SPARQL JSON SELECT answer (unbound values are missing;
+    a cell may also be a plain value instead of a {"value": …} object).
+    With `typed`, literal columns are decoded from their datatype annotation.
+    """
+    head     = data.get('head', {}).get('vars', [])
+    bindings = data.get('results', {}).get('bindings', [])
+    # one pass keeping only the lexical values, so `bindings` may be a
+    # streaming iterator (see decoding.iter_sparql) that is never held whole
+    values = {v: [] for v in head}
+    types  = {v: set() for v in head}
+    for bd in bindings:
+        for v in head:
+            cell = bd.get(v)
+            if cell is None:
+                values[v].append(None)
+            elif not isinstance(cell, dict):
+                values[v].append(cell)
+                types[v].add(None)
+            else:
+                values[v].append(cell.get('value'))
+                types[v].add(cell.get('datatype'))
+    if typed:
+        return pd.DataFrame({v: decode_column(values[v], types[v]) for v in head}, columns=head)
+    return pd.DataFrame(values, columns=head)
+
+
+def read_frame(resp):
+    """
+    Parse a streamed `requests` response straight into a typed DataFrame,
+    binding by binding (for fan_out's `parse`).
+    """
+    resp.raw.decode_content = True
+    data = decoding.iter_sparql(resp.raw)
+    if 'results' not in data:
+        raise ValueError("not a SPARQL SELECT answer")
+    return frame_from_sparql(data)
+
+
+def numeric(series):
+    """
+    `series` as numbers: a no-op for columns already decoded as numeric,
+    a vectorized parse for plain-string columns (nodes that omit datatypes).
+    """
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series
+    return pd.to_numeric(series, errors='coerce')
+
+
+def _repeat_categorical(values, sizes):
+    """Categorical with values[i] repeated sizes[i] times, built from codes."""
+    categories = pd.Index(pd.unique(pd.Series(values, dtype=object)))
+    codes = np.repeat(categories.get_indexer(values), sizes)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def as_text(series):
+    """
+    `series` as lexical strings, missing values as None; dates as `rows`
+    writes them (YYYY-MM-DD when no value has a time of day, else ISO 8601).
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        dates = series.dropna()
+        date_only = series.dt.tz is None and (dates == dates.dt.normalize()).all()
+        text = series.map(lambda d: None if pd.isna(d) else
+                          d.strftime('%Y-%m-%d') if date_only else d.isoformat())
+    else:
+        text = series.astype(object).map(lambda v: None if pd.isna(v) else str(v))
+    return text.astype(object)
+
+
+def _reconciled(frames, columns):
+    """
+    `frames` reindexed to `columns`, with one dtype per column: a variable
+    one node types and another doesn't (or types differently) becomes text
+    in every frame, so the merged column is never a mix of ints and strings
+    that Arrow, and thus the frame cache, can't store. Numbers of different
+    kinds (Int64 and float) are left for concat to widen.
+    """
+    frames = [frame.reindex(columns=columns) for frame in frames]
+    for c in columns:
+        # parts without a value for `c` don't get a say in its type
+        typed = [frame[c] for frame in frames if frame[c].notna().any()]
+        if not typed:
+            continue
+        numbers = all(pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column)
+                      for column in typed)
+        if len({str(column.dtype) for column in typed}) > 1 and not numbers:
+            for frame in frames:
+                frame[c] = as_text(frame[c])
+            continue
+        for frame in frames:
+            if frame[c].dtype != typed[0].dtype and not frame[c].notna().any():
+                frame[c] = frame[c].astype(typed[0].dtype)
+    return frames
+
+
+def merge(parts, columns=None):
+    """
+    Concatenate per-endpoint frames.
+
+    `parts` is a list of (endpoint name, logo url, frame). The result has the
+    endpoint's variables plus categorical `endpoint` and (unless all logo urls
+    are None) `logo_url` columns.
+    `columns` fixes the variable columns (default: union, in order of appearance).
+    A variable whose dtype differs between endpoints is merged as text.
+    """
+    if columns is None:
+        columns = []
+        for _, _, frame in parts:
+            columns.extend(c for c in frame.columns if c not in columns)
+
+    if not parts:
+        merged = pd.DataFrame(columns=columns)
+        merged['endpoint'] = pd.Categorical([])
+        merged['logo_url'] = pd.Categorical([])
+        return merged
+
+    merged = pd.concat(_reconciled([frame for _, _, frame in parts], columns),
+                       ignore_index=True)
+    sizes = [len(frame) for _, _, frame in parts]
+    merged['endpoint'] = _repeat_categorical([name for name, _, _ in parts], sizes)
+    logos = [logo for _, logo, _ in parts]
+    if any(logo is not None for logo in logos):
+        merged['logo_url'] = _repeat_categorical([logo or '' for logo in logos], sizes)
+    return merged
+
+
+def rows(frame, columns):
+    """
+    Plain Python rows of `columns` (missing values as None, dates as ISO
+    strings), for templates and JSON.
+    """
+    out = frame[columns].copy()
+    for c in columns:
+        if pd.api.types.is_datetime64_any_dtype(out[c]):
+            dates = out[c]
+            date_only = dates.dt.tz is None and (dates.dropna() == dates.dropna().dt.normalize()).all()
+            out[c] = dates.dt.strftime('%Y-%m-%d') if date_only else dates.map(
+                lambda d: None if pd.isna(d) else d.isoformat())
+    out = out.astype(object)
+    return out.where(out.notna(), None).to_numpy().tolist()
@@ -0,0 +1,111 @@
+# catalogapp/decoding.py
+"""
+Decoding of endpoint responses.
+
+`loads` uses the fastest JSON backend installed (orjson, then ujson) and
+falls back to the standard library; FEDERATION_JSON_DECODER pins one.
+`iter_sparql` is the streaming alternative: with ijson installed it walks a
+SPARQL JSON results document and yields its bindings one at a time, without
+ever holding the whole document in memory.
+"""
+import json
+
+import urllib3
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # optional
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # optional
+    ujson = None
+
+try:
+    import ijson
+except ImportError:  # optional
+    ijson = None
+
+# what a streaming parse of `resp.raw` may raise besides ValueError: a
+# truncated or malformed document, or the connection failing mid-body
+STREAM_ERRORS = (urllib3.exceptions.HTTPError,) + ((ijson.JSONError,) if ijson is not None else ())
+
+
+def _decoders():
+    found = {}
+    if orjson is not None:
+        found['orjson'] = orjson.loads
+    if ujson is not None:
+        found['ujson'] = ujson.loads
+    found['json'] = json.loads
+    return found
+
+
+DECODERS = _decoders()
+
+
+def get_decoder(name=None):
+    """
+    The `loads` function for `name` ('orjson', 'ujson', 'json'),
+    or the fastest installed one for None / 'auto'.
+    """
+    name = name or getattr(settings, 'FEDERATION_JSON_DECODER', 'auto')
+    if name == 'auto':
+        return next(iter(DECODERS.values()))
+    try:
+        return DECODERS[name]
+    except KeyError:
+        raise ValueError(f"JSON decoder {name!r} is not installed") from None
+
+
+def loads(content):
+    """Decode a whole JSON document (bytes or str)."""
+    return get_decoder()(content)
+
+
+def read_json(resp):
+    """Decode a `requests` response body."""
+    return loads(resp.content)
+
+
+def iter_sparql(fileobj):
+    """
+    Incrementally parse a SPARQL JSON results document from a file-like object.
+
+    Returns a dict shaped like the document, except that for SELECT answers
+    `results.bindings` is an iterator that parses bindings as it is consumed:
+      {'head': {'vars': [...]}, 'boolean': b}                 – ASK
+      {'head': {'vars': [...]}, 'results': {'bindings': it}}  – SELECT
+    `head` must come before `results`, as the SPARQL JSON results format lays it out.
+    Without ijson, the document is decoded whole and the same shape returned.
+    """
+    if ijson is None:
+        data = loads(fileobj.read())
+        if 'results' in data:
+            data['results']['bindings'] = iter(data['results'].get('bindings', []))
+        return data
+
+    events = ijson.parse(fileobj, use_float=True)
+    head = []
+    for prefix, event, value in events:
+        if prefix == 'head.vars.item':
+            head.append(value)
+        elif prefix == 'boolean':
+            return {'head': {'vars': head}, 'boolean': value}
+        elif prefix == 'results.bindings' and event == 'start_array':
+            return {'head': {'vars': head}, 'results': {'bindings': _iter_bindings(events)}}
+    return {'head': {'vars': head}}
+
+
+def _iter_bindings(events):
+    builder = None
+    for prefix, event, value in events:
+        if prefix == 'results.bindings' and event == 'end_array':
+            return
+        if prefix == 'results.bindings.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+        builder.event(event, value)
+        if prefix == 'results.bindings.item' and event == 'end_map':
+            yield builder.value
@@ -0,0 +1,275 @@
+# catalogapp/export.py
+"""
+Streaming export of federated query results as CSV, NDJSON or Parquet.
+
+`fan_out_chunks` runs the fan-out in the background and parses each
+endpoint's response binding by binding, handing over frames of at most
+EXPORT_CHUNK_ROWS rows through a small bounded queue as they are parsed;
+the writers below turn every chunk into bytes right away. Rows therefore
+reach the client while the endpoints are still answering, and memory is
+bounded by a few chunks, never by the size of the result.
+
+While an export is downloaded, each endpoint still sending holds one
+worker of a pool of its own (EXPORT_MAX_WORKERS), waiting for the client to
+take the next chunk, so slow downloads never hold the federation workers
+the query views need.
+
+An endpoint that fails, before or while sending, is reported in the file:
+an {"endpoint": …, "error": …} line in NDJSON, the `failed_endpoints` key
+of the Parquet footer; CSV has no place for it, so the download is
+aborted instead of ending without that endpoint's rows.
+"""
+import contextlib
+import io
+import itertools
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+
+import pandas as pd
+from django.conf import settings
+
+from . import columnar, decoding
+from .federation import Cancelled, iter_fan_out
+
+FORMATS = {
+    'csv':     ('text/csv; charset=utf-8', 'csv'),
+    'ndjson':  ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+_DONE = object()
+
+_executor      = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process-wide pool of export calls, apart from the federation pool."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'EXPORT_MAX_WORKERS', 8),
+                thread_name_prefix='export',
+            )
+        return _executor
+
+
+@dataclass
+class Failed:
+    """An endpoint that failed, in place of its chunks."""
+    endpoint: str
+    error:    str
+
+
+def fan_out_chunks(endpoints, template, query, chunk_rows=10000, queue_size=4, transform=None):
+    """
+    Yield (endpoint name, frame) chunks of every endpoint's SELECT answer,
+    in the order they are parsed, and a Failed for each endpoint that fails
+    (one failing halfway has sent its first rows already). `transform(frame)`,
+    if given, is applied to each chunk. Closing the generator cancels the
+    endpoints still sending.
+    """
+    chunks = queue.Queue(maxsize=queue_size)
+    cancelled = threading.Event()
+    errors = []
+
+    def put(item):
+        # block while the client is slower than the endpoints, not forever
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+        raise Cancelled("export cancelled")
+
+    def parse(name, resp):
+        # runs in the export worker thread of this endpoint
+        resp.raw.decode_content = True
+        data = decoding.iter_sparql(resp.raw)
+        if 'boolean' in data:
+            put((name, pd.DataFrame({'boolean': [bool(data['boolean'])]})))
+            return 1
+        if 'results' not in data:   # known template, no results
+            return 0
+        head, bindings, n = data['head'], data['results']['bindings'], 0
+        while True:
+            chunk = columnar.frame_from_sparql(
+                {'head': head, 'results': {'bindings': itertools.islice(bindings, chunk_rows)}})
+            if len(chunk) or not n:
+                put((name, chunk))
+            n += len(chunk)
+            if len(chunk) < chunk_rows:
+                return n
+
+    def run():
+        try:
+            # paced by the client: no latency worth adapting timeouts to
+            for res in iter_fan_out(endpoints, template, query, executor=get_executor(), timed=False,
+                                    parse_for=lambda ep: partial(parse, ep.name)):
+                if not res.ok and not cancelled.is_set():
+                    print(f"EXPORT: endpoint {res.endpoint.name} failed with {res.error}")
+                    put(Failed(res.endpoint.name, str(res.error)))
+        except Exception as ex:
+            # not an endpoint failing: the export itself is broken
+            errors.append(ex)
+        finally:
+            if not cancelled.is_set():
+                put(_DONE)
+
+    threading.Thread(target=run, name='export', daemon=True).start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Failed):
+                yield item
+                continue
+            name, frame = item
+            yield name, transform(frame) if transform else frame
+    finally:
+        cancelled.set()
+    if errors:
+        raise errors[0]
+
+
+def frame_chunks(batches):
+    """(endpoint name, frame) chunks of merged frames that carry an `endpoint` column."""
+    for frame in batches:
+        for name, part in frame.groupby('endpoint', sort=False, observed=True):
+            yield str(name), part.drop(columns='endpoint')
+
+
+def _aligned(chunks):
+    """
+    Chunks as frames with the endpoint first and the columns of the first
+    chunk (the template's variables), whatever order later ones come in;
+    Failed endpoints are passed on as they are.
+    """
+    columns = None
+    # closing the writer (the client went away) cancels the fan-out at once
+    with contextlib.closing(chunks):
+        for item in chunks:
+            if isinstance(item, Failed):
+                yield item
+                continue
+            name, frame = item
+            if columns is None:
+                columns = [c for c in frame.columns if c not in ('endpoint', 'logo_url')]
+            part = frame.reindex(columns=columns)
+            part.insert(0, 'endpoint', name)
+            yield part
+
+
+def csv_stream(chunks):
+    header = True
+    for part in _aligned(chunks):
+        if isinstance(part, Failed):
+            raise ValueError(f"Endpoint {part.endpoint} failed: {part.error}")
+        if header or len(part):
+            # the same date strings as the NDJSON export
+            for c in part.columns:
+                if pd.api.types.is_datetime64_any_dtype(part[c]):
+                    part[c] = columnar.as_text(part[c])
+            yield part.to_csv(index=False, header=header)
+            header = False
+
+
+def ndjson_stream(chunks):
+    for part in _aligned(chunks):
+        if isinstance(part, Failed):
+            yield json.dumps({'endpoint': part.endpoint, 'error': part.error}) + '\n'
+            continue
+        columns = list(part.columns)
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n'
+                      for row in columnar.rows(part, columns))
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file whose bytes are taken out after each row group."""
+
+    def __init__(self):
+        self._parts, self._pos = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def take(self):
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+def parquet_stream(chunks):
+    """
+    One Parquet row group per chunk, streamed as written. The columns are
+    typed from the first chunk with rows (those it leaves unbound are
+    strings) and later chunks are cast to those types: the lexical values of
+    nodes that omit datatypes are parsed, typed values become text. Row
+    groups already sent can't be widened, so a value that doesn't fit at
+    all (e.g. 2.5 in an integer column) aborts the download, rather than
+    being written as a null. Failed endpoints are listed, as JSON, under the
+    `failed_endpoints` key of the footer.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink, writer, schema, part, failed = _Sink(), None, None, None, []
+    try:
+        for item in _aligned(chunks):
+            if isinstance(item, Failed):
+                failed.append({'endpoint': item.endpoint, 'error': item.error})
+                continue
+            part = item
+            if not len(part):
+                continue
+            part['endpoint'] = part['endpoint'].astype(str)
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            if writer is None:
+                schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                    for f in table.schema], metadata=table.schema.metadata)
+                writer = pq.ParquetWriter(sink, schema)
+            writer.write_table(_conform(table, schema))
+            yield sink.take()
+        if writer is None:
+            # no rows at all: still a valid file, with the template's variables
+            columns = list(part.columns) if part is not None else ['endpoint']
+            writer = pq.ParquetWriter(sink, pa.schema([(c, pa.string()) for c in columns]))
+        if failed:
+            writer.add_key_value_metadata({'failed_endpoints': json.dumps(failed)})
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.take()
+
+
+def _conform(table, schema):
+    """`table` cast to `schema`; ValueError naming the column that can't be."""
+    import pyarrow as pa
+
+    try:
+        return table.cast(schema)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        pass
+    for name, field in zip(table.column_names, schema):
+        try:
+            table[name].cast(field.type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as ex:
+            raise ValueError(f"Column {name!r} doesn't fit {field.type}: {ex}") from ex
+    raise ValueError("Chunk doesn't fit the Parquet schema")
+
+
+WRITERS = {'csv': csv_stream, 'ndjson': ndjson_stream, 'parquet': parquet_stream}
@@ -0,0 +1,278 @@
+# catalogapp/federation.py
+"""
+Concurrent fan-out of an instantiated SPARQL query to every registered endpoint.
+
+All the federated views (query, analytics, training) go through `fan_out`,
+so a request takes as long as the slowest node instead of the sum of all of them.
+
+Identical calls (same endpoint, query, Accept header and parser) made while
+one is already in flight join it instead of being sent again: concurrent
+identical fan-outs share one dispatch, and every caller gets the same
+EndpointResult, whose `data` must therefore be treated as read-only.
+"""
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .breaker import EndpointUnavailable, breaker_for
+from .cache import get_result_cache
+from .decoding import STREAM_ERRORS, read_json
+from . import warehouse
+
+SPARQL_JSON = 'application/sparql-results+json'
+PLAIN_JSON  = 'application/json'
+
+# one process-wide pool, so the cap holds across concurrent requests too
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'FEDERATION_MAX_WORKERS', 16),
+    thread_name_prefix='federation',
+)
+
+# keep-alive sessions, one per Endpoint.url (see `session_for`)
+_sessions      = {}
+_sessions_lock = threading.Lock()
+
+# endpoint calls in flight, shared by identical concurrent fan-outs (see `_submit`)
+_inflight      = {}
+_inflight_lock = threading.Lock()
+
+
+class Cancelled(Exception):
+    """Raised by a `parse` hook whose caller no longer wants the answer."""
+
+
+@dataclass
+class EndpointResult:
+    """
+    Outcome of one endpoint call: either the decoded JSON `data`
+    or the `error` that prevented us from getting it.
+    """
+    endpoint: Any
+    data:     Any = None
+    error:    Optional[Exception] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def skipped(self):
+        return isinstance(self.error, EndpointUnavailable)
+
+    @property
+    def failure(self):
+        """How to list this endpoint among the failed ones."""
+        if self.skipped:
+            return f"{self.endpoint.name} – {self.error}"
+        return self.endpoint.name
+
+
+def sparql_url(ep):
+    """The protected SPARQL API of an endpoint, e.g. http://host/api3/sparql-protected/"""
+    return ep.url.rstrip('/') + '/sparql-protected/'
+
+
+def mask_template(template):
+    """
+    Mask out the template markers so they don’t get sent along
+    (the node matches the masked text against its allowed queries).
+    """
+    return template.replace('<{', '**<').replace('}>', '>**')
+
+
+def _new_session():
+    retry = Retry(
+        total=getattr(settings, 'FEDERATION_RETRIES', 2),
+        backoff_factor=getattr(settings, 'FEDERATION_BACKOFF', 0.3),
+        # a node that timed out is slow, not gone: resending the query would
+        # only multiply the wait and its load, so read errors aren't retried
+        read=0,
+        status_forcelist=(502, 503, 504),
+        # the SPARQL POSTs are read-only, so they are safe to repeat
+        allowed_methods=frozenset(['GET', 'POST']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=getattr(settings, 'FEDERATION_POOL_SIZE', 4),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def session_for(url):
+    """
+    The process-wide keep-alive session for an endpoint URL, so repeated
+    queries to the same node reuse its TCP/TLS connections.
+    """
+    with _sessions_lock:
+        session = _sessions.get(url)
+        if session is None:
+            session = _sessions[url] = _new_session()
+        return session
+
+
+def reset_session(*urls):
+    """
+    Drop (and close) the pooled sessions of the given endpoint URLs;
+    call it whenever an endpoint is edited or deleted.
+    """
+    with _sessions_lock:
+        for url in urls:
+            session = _sessions.pop(url, None)
+            if session is not None:
+                session.close()
+
+
+def _post(ep, body, accept, timeout, parse=None):
+    try:
+        with session_for(ep.url).post(
+            sparql_url(ep),
+            data=body,
+            headers={
+                'Accept':       accept,
+                'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'
+            },
+            timeout=timeout,
+            stream=parse is not None,
+        ) as resp:
+            # Raise an exception if status is 4xx/5xx
+            resp.raise_for_status()
+            return EndpointResult(ep, data=(parse or read_json)(resp))
+    except Cancelled as ex:
+        # not the endpoint's fault: see _dispatch
+        return EndpointResult(ep, error=ex)
+    except (requests.RequestException, ValueError) + STREAM_ERRORS as ex:
+        # timeout, HTTP error, connection error or a body that isn't JSON
+        # (including one cut short while a `parse` hook was streaming it)
+        return EndpointResult(ep, error=ex)
+
+
+def _submit(key, fn, *args, executor=None):
+    """
+    Single flight: run `fn(*args)` on the pool (or `executor`) unless a call
+    with the same `key` is already in flight, and return the Future every
+    caller waits on.
+    """
+    executor = executor or _executor
+    if not getattr(settings, 'FEDERATION_SINGLE_FLIGHT', True):
+        return executor.submit(fn, *args)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = _inflight[key] = executor.submit(fn, *args)
+    future.add_done_callback(lambda f: _forget(key, f))
+    return future
+
+
+def _forget(key, future):
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+
+def _dispatch(endpoints, template, query, accept, timeout, entry, params, parse, extra,
+              parse_for=None, executor=None, timed=True):
+    """
+    Serve what we can from the result cache, skip endpoints whose breaker
+    is open, and submit the rest (joining identical calls already in flight).
+    Fresh answers are recorded in the warehouse.
+    Returns {index: EndpointResult} for the cache hits and {future: index} for the calls.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'FEDERATION_TIMEOUT', 5)
+
+    body = urllib.parse.urlencode({
+        'template': mask_template(template),
+        'query':    query,
+        **extra,
+    }, quote_via=urllib.parse.quote, safe='')
+
+    # custom parsers don't produce JSON documents, so they bypass the cache
+    cache = get_result_cache() if entry is not None and parse is None and parse_for is None else None
+    params = {**(params or {}), **extra}
+
+    def call(ep, breaker, parse):
+        start = time.monotonic()
+        res = _post(ep, body, accept, breaker.timeout(timeout, template), parse)
+        if isinstance(res.error, Cancelled):
+            # the caller went away: says nothing about the endpoint
+            breaker.release()
+        elif res.ok:
+            breaker.record_success(time.monotonic() - start if timed else None, template)
+            if cache is not None:
+                cache.set(entry, params, ep, res.data)
+            if entry is not None:
+                warehouse.record(entry, params, ep.name, res.data)
+        else:
+            breaker.record_failure()
+        return res
+
+    hits, futures = {}, {}
+    for i, ep in enumerate(endpoints):
+        data = cache.get(entry, params, ep) if cache is not None else None
+        if data is not None:
+            hits[i] = EndpointResult(ep, data=data)
+            continue
+        breaker = breaker_for(ep)
+        if breaker.allow():
+            # identical concurrent fan-outs (e.g. a dashboard loaded by many
+            # users at once) share the call and its result
+            parser = parse_for(ep) if parse_for is not None else parse
+            futures[_submit((ep.pk, ep.url, body, accept, parser), call, ep, breaker, parser,
+                            executor=executor)] = i
+        else:
+            # known to be down: don't wait out its timeout
+            hits[i] = EndpointResult(ep, error=EndpointUnavailable())
+    return hits, futures
+
+
+def fan_out(endpoints, template, query, accept=SPARQL_JSON, timeout=None,
+            entry=None, params=None, parse=None, parse_for=None, executor=None, timed=True, **extra):
+    """
+    POST `query` (and its masked `template`) to all `endpoints` at once.
+
+    Any `extra` form fields (e.g. analytics_key) are sent along.
+    When the catalog `entry` and the `params` it was instantiated with are
+    given, answers are served from / stored in the result cache.
+    `parse(resp)`, if given, decodes each streamed response in its worker
+    thread instead of the whole-document JSON decoder (see columnar.read_frame);
+    `parse_for(ep)` instead returns the parser of each endpoint's response.
+    A parser raising Cancelled ends that call with no effect on the breaker.
+    `executor` runs the calls instead of the shared FEDERATION_MAX_WORKERS pool.
+    With `timed=False` the calls' latencies are kept out of the adaptive
+    timeouts (for calls paced by their caller, e.g. exports).
+    Returns one EndpointResult per endpoint, in the order of `endpoints`.
+    """
+    endpoints = list(endpoints)
+    hits, futures = _dispatch(endpoints, template, query, accept, timeout, entry, params, parse, extra,
+                              parse_for, executor, timed)
+    for f, i in futures.items():
+        hits[i] = f.result()
+    return [hits[i] for i in range(len(endpoints))]
+
+
+def iter_fan_out(endpoints, template, query, accept=SPARQL_JSON, timeout=None,
+                 entry=None, params=None, parse=None, parse_for=None, executor=None, timed=True,
+                 **extra):
+    """
+    Same as `fan_out`, but yield each EndpointResult as soon as its endpoint
+    answers (cached answers first), for progressive rendering.
+    """
+    hits, futures = _dispatch(list(endpoints), template, query, accept, timeout, entry, params, parse, extra,
+                              parse_for, executor, timed)
+    yield from hits.values()
+    for f in as_completed(futures):
+        yield f.result()
@@ -0,0 +1,257 @@
+# catalogapp/frame_cache.py
+"""
+Cache of merged federated DataFrames, shared by the query, analytics and
+training views.
+
+A complete fan-out (every endpoint answered) is saved as one uncompressed
+Arrow IPC file, FRAME_CACHE_DIR/<key>.arrow, keyed on (template hash,
+normalized parameters, endpoint set). Files are memory-mapped on read, so a
+re-training on the data a session just fetched costs a file map instead of
+a round trip to every node; being on disk, they are shared by every web
+worker and by every user asking the same question.
+
+Entries are fresh for FRAME_CACHE_TTL seconds. A session also pins the
+frames it used (see `remember`): it keeps getting the very same data, e.g.
+while it compares tree parameters, until the file is evicted. At most
+FRAME_CACHE_MAX_BYTES are kept on disk, least recently used first out.
+
+The same files back the paginated query results (`page`): a result set is
+never rendered whole, each page is sliced out of the mapped file; exports
+read it a record batch at a time (`batches`).
+
+With FRAME_CACHE_SINGLE_FLIGHT, a worker process about to fetch a frame
+first takes its lock file (see `flight`): identical fan-outs started
+meanwhile in other workers wait for it, then read the cached frame.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .cache import normalize_params
+
+SESSION_KEY = 'frame_cache'
+LOCK_FILES  = 64   # keys share this many lock files, so they don't pile up
+
+
+def frame_key(entry, params, endpoints):
+    """Cache key of `entry` instantiated with `params` and sent to `endpoints`."""
+    endpoint_set = sorted((ep.pk, ep.url) for ep in endpoints)
+    raw = json.dumps([entry['hash'], normalize_params(params), endpoint_set])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class FrameCache:
+
+    def __init__(self, directory, max_bytes=1 << 30, ttl=300):
+        import pyarrow   # noqa: F401 – fail early when it is missing
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl       = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def get(self, key, pinned=False):
+        """
+        The cached frame, or None when missing or older than the TTL
+        (`pinned` frames never expire, they are only evicted).
+        """
+        import pyarrow as pa
+
+        path = self.path(key)
+        try:
+            written = os.path.getmtime(path)
+            if not pinned and time.time() - written > self.ttl:
+                return None
+            with pa.memory_map(path) as source:
+                frame = pa.ipc.open_file(source).read_all().to_pandas()
+            # atime = last use, for the LRU eviction; mtime stays the write time
+            os.utime(path, (time.time(), written))
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return frame
+
+    def page(self, key, offset, limit, sort=None, descending=False):
+        """
+        (total rows, frame of rows offset … offset+limit) of a cached frame,
+        optionally sorted on column `sort`; only those rows are converted to
+        pandas. Raises KeyError once the frame is evicted, ValueError for an
+        unknown sort column.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        path = self.path(key)
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+                if sort is None:
+                    rows = table.slice(offset, limit)
+                else:
+                    if sort not in table.column_names:
+                        raise ValueError(f"Unknown column {sort!r}")
+                    column = table[sort]
+                    if pa.types.is_dictionary(column.type):
+                        column = column.cast(column.type.value_type)
+                    order = pc.array_sort_indices(column, order='descending' if descending else 'ascending')
+                    rows = table.take(order[offset:offset + limit])
+                frame = rows.to_pandas()
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except FileNotFoundError:
+            raise KeyError(key) from None
+        return table.num_rows, frame
+
+    def batches(self, key, size, pinned=False):
+        """
+        Iterator over the cached frame as frames of at most `size` rows,
+        each converted to pandas only when reached; None as `get` would.
+        """
+        import pyarrow as pa
+
+        path = self.path(key)
+        try:
+            written = os.path.getmtime(path)
+            if not pinned and time.time() - written > self.ttl:
+                return None
+            # the open map outlives an eviction or overwrite of the file
+            source = pa.memory_map(path)
+        except FileNotFoundError:
+            return None
+        try:
+            table = pa.ipc.open_file(source).read_all()
+        except pa.ArrowInvalid:
+            source.close()
+            return None
+        try:
+            os.utime(path, (time.time(), written))
+        except FileNotFoundError:
+            pass
+
+        def frames():
+            with source:
+                for batch in table.to_batches(max_chunksize=size):
+                    yield batch.to_pandas()
+        return frames()
+
+    def put(self, key, frame):
+        """
+        Save `frame` under `key`; frames Arrow can't represent (e.g. object
+        columns of mixed types) are simply not cached.
+        """
+        import pyarrow as pa
+
+        try:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            return False
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp, path)   # atomic: concurrent writers just overwrite each other
+        self.prune()
+        return True
+
+    def prune(self):
+        """Delete the least recently used files beyond max_bytes."""
+        with self._lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.arrow'):
+                    try:
+                        st = os.stat(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_atime, st.st_size, name))
+            total = sum(size for _, size, _ in files)
+            for _, size, name in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass   # another worker got there first
+                total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.arrow'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+@contextmanager
+def flight(key):
+    """
+    Hold the lock file of `key`, across worker processes, for the duration
+    of the block; yields whether it did (FRAME_CACHE_SINGLE_FLIGHT is on).
+    """
+    cache = get_frame_cache()
+    if key is None or cache is None or not getattr(settings, 'FRAME_CACHE_SINGLE_FLIGHT', False):
+        yield False
+        return
+    import fcntl
+
+    path = os.path.join(cache.directory, f"flight-{int(key[:8], 16) % LOCK_FILES}.lock")
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def pinned(session, key):
+    """True if the session already used the frame `key`."""
+    return session is not None and key in session.get(SESSION_KEY, [])
+
+
+def remember(session, key):
+    """Pin the frame `key` to the session (the most recent ones are kept)."""
+    if session is None:
+        return
+    keys = [k for k in session.get(SESSION_KEY, []) if k != key] + [key]
+    session[SESSION_KEY] = keys[-getattr(settings, 'FRAME_CACHE_SESSION_MAX', 32):]
+
+
+_cache      = None
+_cache_lock = threading.Lock()
+
+
+def get_frame_cache():
+    """
+    The process-wide FrameCache configured by FRAME_CACHE_* settings, or
+    None when it is disabled (FRAME_CACHE_MAX_BYTES = 0) or pyarrow is missing.
+    """
+    global _cache
+    max_bytes = getattr(settings, 'FRAME_CACHE_MAX_BYTES', 1 << 30)
+    if not max_bytes:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = FrameCache(
+                    getattr(settings, 'FRAME_CACHE_DIR', None) or os.path.join(
+                        os.path.dirname(settings.ALLOWED_DB), 'frames'),
+                    max_bytes=max_bytes,
+                    ttl=getattr(settings, 'FRAME_CACHE_TTL', 300),
+                )
+            except ImportError:
+                return None
+        return _cache
+
+
+def invalidate():
+    cache = get_frame_cache()
+    if cache is not None:
+        cache.clear()
@@ -0,0 +1,145 @@
+# catalogapp/health.py
+"""
+Background health checks of the registered endpoints.
+
+Every HEALTH_CHECK_INTERVAL seconds all endpoints are probed in parallel and
+the outcome is stored in their EndpointHealth row (status, last-seen time and
+latency percentiles over the last HEALTH_CHECK_WINDOW probes). The manager
+page and the status API only read that stored state. Probe outcomes also
+feed the endpoints' circuit breakers (see catalogapp.breaker).
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urljoin
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .breaker import breaker_for
+from .federation import session_for
+from .models import Endpoint, EndpointHealth
+
+_monitor      = None
+_monitor_lock = threading.Lock()
+
+
+def probe_url(ep):
+    """
+    The "sparql-protected" URL under whatever path the endpoint URL has,
+    e.g. "http://tdn.dei.unipd.it" + "/api3" + "/sparql-protected/".
+    """
+    parsed = urlparse(ep.url)
+    base_netloc = f"{parsed.scheme}://{parsed.netloc}"
+    # strip any trailing slash so we don’t get "//sparql-protected"
+    prefix = parsed.path.rstrip("/")
+    return urljoin(base_netloc, prefix + "/sparql-protected/")
+
+
+def probe(ep):
+    """
+    GET the protected SPARQL URL once; returns (online, latency, error).
+    The URL only accepts POST, so a 405 Method Not Allowed means “online”.
+    """
+    start = time.monotonic()
+    try:
+        resp = session_for(ep.url).get(probe_url(ep), timeout=getattr(settings, 'HEALTH_CHECK_TIMEOUT', 2))
+    except requests.RequestException as ex:
+        return False, None, str(ex)[:255]
+    latency = time.monotonic() - start
+    if resp.status_code == 405:
+        return True, latency, ''
+    return False, latency, f"HTTP {resp.status_code}"
+
+
+def _percentile(ordered, q):
+    # nearest-rank percentile of an already sorted list
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def record(ep, online, latency, error=''):
+    """Store one probe outcome in the endpoint's EndpointHealth row."""
+    health, _ = EndpointHealth.objects.get_or_create(endpoint=ep)
+    now = timezone.now()
+    health.online       = online
+    health.error        = error
+    health.last_checked = now
+    if online:
+        health.last_seen = now
+    if latency is not None:
+        window = getattr(settings, 'HEALTH_CHECK_WINDOW', 50)
+        health.latencies = (health.latencies + [round(latency, 4)])[-window:]
+        ordered = sorted(health.latencies)
+        health.latency_p50 = _percentile(ordered, 50)
+        health.latency_p95 = _percentile(ordered, 95)
+        health.latency_p99 = _percentile(ordered, 99)
+    health.save()
+    return health
+
+
+def check_all():
+    """Probe every endpoint in parallel and store the results."""
+    endpoints = list(Endpoint.objects.all())
+    if not endpoints:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(endpoints), 16)) as pool:
+        outcomes = list(pool.map(probe, endpoints))
+    for ep, (online, latency, error) in zip(endpoints, outcomes):
+        record(ep, online, latency, error)
+        breaker_for(ep).record_probe(online)
+
+
+def _run_forever():
+    while True:
+        close_old_connections()
+        try:
+            check_all()
+        except Exception as ex:
+            # never let one bad round kill the monitor
+            print(f"HEALTH: check failed with {ex}")
+        finally:
+            close_old_connections()
+        time.sleep(getattr(settings, 'HEALTH_CHECK_INTERVAL', 60))
+
+
+def ensure_monitor():
+    """
+    Start the background monitor of this process, if it isn't running yet.
+    The first round runs right away (in the background).
+    """
+    global _monitor
+    if not getattr(settings, 'HEALTH_CHECK_INTERVAL', 60):
+        return
+    with _monitor_lock:
+        if _monitor is None or not _monitor.is_alive():
+            _monitor = threading.Thread(target=_run_forever, name='health-monitor', daemon=True)
+            _monitor.start()
+
+
+def status(ep):
+    """JSON-friendly view of an endpoint's stored health."""
+    health = getattr(ep, 'health', None)
+    if health is None:
+        return {'id': ep.pk, 'name': ep.name, 'url': ep.url, 'online': None,
+                'last_checked': None, 'last_seen': None, 'error': '',
+                'breaker': breaker_for(ep).state,
+                'latency': {'p50': None, 'p95': None, 'p99': None}}
+    return {
+        'id':           ep.pk,
+        'name':         ep.name,
+        'url':          ep.url,
+        'online':       health.online,
+        'last_checked': health.last_checked and health.last_checked.isoformat(),
+        'last_seen':    health.last_seen and health.last_seen.isoformat(),
+        'error':        health.error,
+        'breaker':      breaker_for(ep).state,
+        'latency': {
+            'p50': health.latency_p50,
+            'p95': health.latency_p95,
+            'p99': health.latency_p99,
+        },
+    }
@@ -0,0 +1,265 @@
+# catalogapp/jobs.py
+"""
+Background training jobs.
+
+train_model only records a TrainingJob and hands it to `submit`; a runner
+thread fetches the federated data, then the CPU-heavy fitting runs in a pool
+of worker processes (catalogapp.training), as do the cross-validation
+candidates of a hyperparameter search. Progress, metrics and the path of the
+fitted model are stored on the TrainingJob row, and the model itself in the
+model store, so any web worker can answer status polls and predictions.
+
+A worker process killed mid-fit (e.g. by the OOM killer) breaks the
+process pool, which is then replaced; jobs whose web worker itself stopped
+are marked failed by the next one to look at them (see `fail_orphans`).
+"""
+import json
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import training
+from .model_store import get_model_store
+from .models import TrainingJob
+
+WORKER = f"{socket.gethostname()}:{os.getpid()}"
+UNFINISHED = (TrainingJob.QUEUED, TrainingJob.FETCHING, TrainingJob.TRAINING)
+
+_runner    = None
+_processes = None
+_pool_lock = threading.Lock()
+_recovered = False
+
+
+def _new_processes():
+    # spawn, not fork: this process runs threads (fan-out, health monitor)
+    return ProcessPoolExecutor(max_workers=getattr(settings, 'TRAINING_WORKERS', 2),
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def _pools():
+    global _runner, _processes
+    with _pool_lock:
+        if _runner is None:
+            workers = getattr(settings, 'TRAINING_WORKERS', 2)
+            _runner = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='training')
+            _processes = _new_processes()
+    fail_orphans()
+    return _runner, _processes
+
+
+def _replace_processes(broken):
+    """Swap in a new process pool for `broken` (unless another thread already did)."""
+    global _processes
+    with _pool_lock:
+        if _processes is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _processes = _new_processes()
+
+
+def _run_in_process(fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs) on the process pool. A pool broken by an earlier job
+    is replaced first; one broken by this call is replaced, and the call
+    fails with a readable error.
+    """
+    _, processes = _pools()
+    try:
+        future = processes.submit(fn, *args, **kwargs)
+    except BrokenProcessPool:
+        _replace_processes(processes)
+        _, processes = _pools()
+        future = processes.submit(fn, *args, **kwargs)
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        _replace_processes(processes)
+        raise RuntimeError("The training process died (out of memory?)") from None
+
+
+def _alive(worker):
+    """False only when `worker` (host:pid) is known to be gone."""
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname():
+        return True   # can't tell from here
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        pass
+    return True
+
+
+def _orphaned(job):
+    return job.status in UNFINISHED and job.worker != WORKER and not (job.worker and _alive(job.worker))
+
+
+def fail_orphans():
+    """
+    Once per process: mark failed the unfinished jobs whose web worker is
+    gone (restarted or killed), instead of leaving them queued forever.
+    """
+    global _recovered
+    if _recovered:
+        return
+    _recovered = True
+    for job in TrainingJob.objects.filter(status__in=UNFINISHED).exclude(worker=WORKER):
+        if _orphaned(job):
+            _interrupted(job.pk)
+
+
+def _interrupted(job_id):
+    _update(job_id, status=TrainingJob.FAILED, message="Training failed",
+            error="The worker process running this job stopped")
+
+
+def _update(job_id, **fields):
+    TrainingJob.objects.filter(pk=job_id).update(**fields)
+
+
+def _run(job_id, fetch):
+    close_old_connections()
+    try:
+        job = TrainingJob.objects.get(pk=job_id)
+        _update(job_id, status=TrainingJob.FETCHING, progress=10,
+                message="Fetching data from the endpoints")
+        df = fetch(job.query_id, job.disease)
+        if df.empty:
+            raise ValueError("No endpoint returned any rows")
+
+        params = job.params
+        best = None
+        if job.search:
+            leaderboard = _search(job, df)
+            best = leaderboard[0]
+            params = best['params']
+            _update(job_id, params=params, leaderboard=leaderboard)
+
+        _update(job_id, status=TrainingJob.TRAINING, progress=90 if best else 50,
+                message=f"Fitting the tree on {len(df)} rows")
+        # the worker process writes the model straight into the model store
+        store = get_model_store()
+        model_path = store.path(job_id)
+        result = _run_in_process(training.fit_tree, df, params, model_path, **_encoding())
+        store.prune()
+
+        metrics = result['metrics']
+        if best:
+            metrics.update({'CV MSE': best['MSE'], 'CV R^2': best['R^2']})
+        _update(job_id, status=TrainingJob.DONE, progress=100, message="Done",
+                metrics=metrics, model_path=model_path)
+    except Exception as ex:
+        _update(job_id, status=TrainingJob.FAILED, message="Training failed", error=str(ex))
+    finally:
+        close_old_connections()
+
+
+def _encoding():
+    return {
+        'encoder': getattr(settings, 'TRAINING_ENCODER', 'onehot'),
+        'sparse':  getattr(settings, 'TRAINING_SPARSE_FEATURES', False),
+    }
+
+
+def _search(job, df):
+    """
+    Cross-validate every candidate of job.search on the process pool and
+    return the leaderboard, best (lowest mean MSE) first. The dataset is
+    encoded once and memory-mapped by the workers.
+    """
+    search = job.search
+    cands = training.candidates(search['grid'], search['mode'], search.get('n_iter', 10))
+    _update(job.pk, status=TrainingJob.TRAINING, progress=50,
+            message=f"Cross-validating {len(cands)} candidates on {len(df)} rows")
+
+    _, processes = _pools()
+    path = os.path.join(get_model_store().directory, f"{job.pk}.dataset")
+    training.save_dataset(df, path, **_encoding())
+    try:
+        try:
+            futures = {processes.submit(training.cv_score, path, p, search['folds']): p
+                       for p in cands}
+        except BrokenProcessPool:   # broken by an earlier job
+            _replace_processes(processes)
+            _, processes = _pools()
+            futures = {processes.submit(training.cv_score, path, p, search['folds']): p
+                       for p in cands}
+        leaderboard = []
+        for done, fut in enumerate(as_completed(futures), 1):
+            try:
+                leaderboard.append(fut.result())
+            except BrokenProcessPool:
+                _replace_processes(processes)
+                raise RuntimeError("A cross-validation process died (out of memory?)") from None
+            except Exception as ex:   # e.g. an invalid parameter value
+                leaderboard.append({'params': futures[fut], 'error': str(ex)})
+            _update(job.pk, progress=50 + 40 * done // len(cands),
+                    message=f"Cross-validated {done}/{len(cands)} candidates")
+    finally:
+        os.remove(path)
+
+    leaderboard.sort(key=lambda r: r.get('MSE', float('inf')))
+    if 'error' in leaderboard[0]:
+        raise ValueError(f"No candidate could be fitted: {leaderboard[0]['error']}")
+    return leaderboard
+
+
+def submit(query_id, disease, params, fetch, search=None):
+    """
+    Queue a training job; `fetch(query_id, disease)` returns its DataFrame.
+    With `search` ({'mode', 'grid', 'folds', 'n_iter'}) the tree parameters
+    are chosen by cross-validated search instead. Returns the TrainingJob.
+    """
+    job = TrainingJob.objects.create(query_id=query_id, disease=disease, params=params,
+                                     search=search, message="Queued", worker=WORKER)
+    runner, _ = _pools()
+    runner.submit(_run, job.pk, fetch)
+    return job
+
+
+def status(job):
+    """JSON-friendly view of a job; results are included once it is done."""
+    fail_orphans()
+    if _orphaned(job):
+        _interrupted(job.pk)
+        job.refresh_from_db()
+    out = {
+        'job_id':   str(job.pk),
+        'status':   job.status,
+        'progress': job.progress,
+        'message':  job.message,
+    }
+    if job.status == TrainingJob.DONE:
+        out.update(metrics=job.metrics, model_id=str(job.pk), params=job.params)
+        if job.leaderboard:
+            out['leaderboard'] = job.leaderboard
+    elif job.status == TrainingJob.FAILED:
+        out['error'] = job.error
+    return out
+
+
+def load_model(model_id):
+    """Fitted model (encoder + tree) of a finished job; raises KeyError if unknown or evicted."""
+    return get_model_store().load(model_id)
+
+
+TREE_IMAGE_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+def tree_json(model_id):
+    """The model's tree as JSON bytes (see training.tree_structure), cached; KeyError if unknown."""
+    return get_model_store().artifact(
+        model_id, 'tree.json', lambda model: json.dumps(training.tree_structure(model)).encode())
+
+
+def tree_image(model_id, fmt):
+    """The model's tree drawn as `fmt` (a TREE_IMAGE_TYPES key), cached; KeyError if unknown."""
+    return get_model_store().artifact(
+        model_id, f'tree.{fmt}', lambda model: training.render_tree(model, fmt))
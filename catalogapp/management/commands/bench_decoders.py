@@ -0,0 +1,78 @@
+# catalogapp/management/commands/bench_decoders.py
+"""
+Micro-benchmark of the endpoint response decoders.
+
+    python manage.py bench_decoders response1.json response2.json …
+    python manage.py bench_decoders --rows 50000
+
+Each file is a recorded SPARQL JSON response (e.g. saved with curl from a
+node's /sparql-protected/). Without files, a synthetic level-6 style answer
+with --rows bindings is used.
+"""
+import io
+import json
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from catalogapp import columnar, decoding
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+
+
+def synthetic_response(rows):
+    rnd = random.Random(0)
+    bindings = [{
+        'pat':    {'type': 'uri', 'value': f'https://example.org/patient/{i}'},
+        'sex':    {'type': 'literal', 'value': rnd.choice(['Male', 'Female'])},
+        'aOns':   {'type': 'literal', 'datatype': XSD + 'integer', 'value': str(rnd.randint(20, 85))},
+        'evType': {'type': 'uri', 'value': 'https://w3id.org/brainteaser/ontology/schema/Onset'},
+        'evStart': {'type': 'literal', 'datatype': XSD + 'date', 'value': f'20{rnd.randint(10, 24)}-01-01'},
+    } for i in range(rows)]
+    doc = {'head': {'vars': ['pat', 'sex', 'aOns', 'evType', 'evStart']},
+           'results': {'bindings': bindings}}
+    return json.dumps(doc).encode()
+
+
+class Command(BaseCommand):
+    help = "Compare the JSON decoders (and the streaming parser) on recorded endpoint responses."
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help="recorded SPARQL JSON responses")
+        parser.add_argument('--rows', type=int, default=20000,
+                            help="bindings in the synthetic response (no files given)")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **opts):
+        if opts['files']:
+            samples = []
+            for path in opts['files']:
+                with open(path, 'rb') as f:
+                    samples.append((path, f.read()))
+        else:
+            samples = [(f"synthetic ({opts['rows']} rows)", synthetic_response(opts['rows']))]
+
+        for label, content in samples:
+            self.stdout.write(f"\n{label}: {len(content) / 1e6:.1f} MB")
+            cases = [(f"loads [{name}]", lambda c=content, f=fn: f(c))
+                     for name, fn in decoding.DECODERS.items()]
+            cases.append(("loads + columns", lambda c=content: columnar.frame_from_sparql(decoding.loads(c))))
+            cases.append((f"stream + columns [{'ijson' if decoding.ijson else 'no ijson'}]",
+                          lambda c=content: columnar.frame_from_sparql(decoding.iter_sparql(io.BytesIO(c)))))
+            for name, fn in cases:
+                self.stdout.write(f"  {name:32s} {self._time(fn, opts['repeat'])}")
+
+    @staticmethod
+    def _time(fn, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return f"{best * 1000:9.1f} ms   peak {peak / 1e6:7.1f} MB"
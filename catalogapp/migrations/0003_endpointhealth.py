@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogapp', '0002_alter_endpoint_logo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EndpointHealth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('online', models.BooleanField(default=False)),
+                ('last_checked', models.DateTimeField(blank=True, null=True)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('latencies', models.JSONField(blank=True, default=list)),
+                ('latency_p50', models.FloatField(blank=True, null=True)),
+                ('latency_p95', models.FloatField(blank=True, null=True)),
+                ('latency_p99', models.FloatField(blank=True, null=True)),
+                ('endpoint', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='health', to='catalogapp.endpoint')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:53
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogapp', '0003_endpointhealth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('fetching', 'fetching'), ('training', 'training'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=10)),
+                ('progress', models.PositiveSmallIntegerField(default=0)),
+                ('message', models.CharField(blank=True, default='', max_length=255)),
+                ('query_id', models.IntegerField()),
+                ('disease', models.CharField(max_length=100)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('metrics', models.JSONField(blank=True, null=True)),
+                ('tree_png', models.TextField(blank=True, default='')),
+                ('model_path', models.CharField(blank=True, default='', max_length=255)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
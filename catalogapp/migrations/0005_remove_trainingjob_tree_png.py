@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogapp', '0004_trainingjob'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='trainingjob',
+            name='tree_png',
+        ),
+    ]
@@ -0,0 +1,129 @@
+# catalogapp/model_store.py
+"""
+Store of fitted models.
+
+Models are serialized with joblib as MODEL_DIR/<model_id>.joblib, so every
+web worker process can load any model, and survive restarts. In front of the
+files each process keeps a small LRU of deserialized models (bounded by
+MODEL_STORE_MAX_MEMORY entries and MODEL_STORE_TTL seconds); on disk at most
+MODEL_STORE_MAX_DISK models are kept, the oldest being deleted first.
+
+Derived artifacts of a model (its tree as JSON, PNG, SVG) are built on first
+request and cached next to it as MODEL_DIR/<model_id>.<name>.
+"""
+import glob
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import joblib
+from django.conf import settings
+
+
+def _checked(model_id):
+    try:
+        return uuid.UUID(str(model_id))
+    except ValueError:
+        raise KeyError(model_id) from None
+
+
+class ModelStore:
+
+    def __init__(self, directory, max_memory=16, ttl=3600, max_disk=200):
+        self.directory  = directory
+        self.max_memory = max_memory
+        self.ttl        = ttl
+        self.max_disk   = max_disk
+        self._memory = OrderedDict()   # model_id -> (loaded_at, obj)
+        self._lock   = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, model_id):
+        """The model's file; KeyError unless `model_id` is a UUID (nothing else is stored)."""
+        return os.path.join(self.directory, f"{_checked(model_id)}.joblib")
+
+    def save(self, model_id, obj):
+        joblib.dump(obj, self.path(model_id))
+        self._remember(str(model_id), obj)
+        self.prune()
+
+    def load(self, model_id):
+        """The stored object; raises KeyError for unknown (or evicted) models."""
+        model_id = str(model_id)
+        with self._lock:
+            item = self._memory.get(model_id)
+            if item is not None and time.time() - item[0] <= self.ttl:
+                self._memory.move_to_end(model_id)
+                return item[1]
+        try:
+            obj = joblib.load(self.path(model_id))
+        except FileNotFoundError:
+            raise KeyError(model_id) from None
+        self._remember(model_id, obj)
+        return obj
+
+    def artifact(self, model_id, name, build):
+        """
+        Bytes of the artifact `name` of a model, built by `build(model)` on
+        first request and cached on disk; raises KeyError for unknown models.
+        """
+        path = os.path.join(self.directory, f"{_checked(model_id)}.{name}")
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        data = build(self.load(model_id))
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)   # atomic: concurrent builders just overwrite each other
+        return data
+
+    def _remember(self, model_id, obj):
+        with self._lock:
+            self._memory[model_id] = (time.time(), obj)
+            self._memory.move_to_end(model_id)
+            now = time.time()
+            for key in [k for k, (t, _) in self._memory.items() if now - t > self.ttl]:
+                del self._memory[key]
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+
+    def prune(self):
+        """Delete the oldest model files (and their artifacts) beyond max_disk."""
+        files = [os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                 if f.endswith('.joblib')]
+        if len(files) <= self.max_disk:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_disk]:
+            model_id = os.path.basename(path)[:-len('.joblib')]
+            for f in glob.glob(os.path.join(glob.escape(self.directory), glob.escape(model_id) + '.*')):
+                try:
+                    os.remove(f)
+                except FileNotFoundError:
+                    pass   # another worker got there first
+        with self._lock:
+            for key in [k for k in self._memory if not os.path.exists(self.path(k))]:
+                del self._memory[key]
+
+
+_store      = None
+_store_lock = threading.Lock()
+
+
+def get_model_store():
+    """The process-wide ModelStore configured by MODEL_DIR / MODEL_STORE_* settings."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ModelStore(
+                getattr(settings, 'MODEL_DIR', os.path.join(os.path.dirname(settings.ALLOWED_DB), 'models')),
+                max_memory=getattr(settings, 'MODEL_STORE_MAX_MEMORY', 16),
+                ttl=getattr(settings, 'MODEL_STORE_TTL', 3600),
+                max_disk=getattr(settings, 'MODEL_STORE_MAX_DISK', 200),
+            )
+        return _store
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 
 class Endpoint(models.Model):
@@ -7,4 +9,51 @@ class Endpoint(models.Model):
         upload_to='endpoint_logos/', 
         blank=True, 
         null=True
-    )
\ No newline at end of file
+    )
+
+class EndpointHealth(models.Model):
+    """
+    Last known state of an endpoint, kept up to date by catalogapp.health
+    so the manager page never has to probe the nodes itself.
+    """
+    endpoint     = models.OneToOneField(Endpoint, on_delete=models.CASCADE, related_name='health')
+    online       = models.BooleanField(default=False)
+    last_checked = models.DateTimeField(null=True, blank=True)
+    last_seen    = models.DateTimeField(null=True, blank=True)
+    error        = models.CharField(max_length=255, blank=True, default='')
+    # recent probe latencies (seconds, oldest first) and their percentiles
+    latencies    = models.JSONField(default=list, blank=True)
+    latency_p50  = models.FloatField(null=True, blank=True)
+    latency_p95  = models.FloatField(null=True, blank=True)
+    latency_p99  = models.FloatField(null=True, blank=True)
+
+
+class TrainingJob(models.Model):
+    """
+    A train_model request, run in the background by catalogapp.jobs.
+    Its id doubles as the id of the fitted model.
+    """
+    QUEUED   = 'queued'
+    FETCHING = 'fetching'
+    TRAINING = 'training'
+    DONE     = 'done'
+    FAILED   = 'failed'
+    STATUS_CHOICES = [(s, s) for s in (QUEUED, FETCHING, TRAINING, DONE, FAILED)]
+
+    id         = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status     = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress   = models.PositiveSmallIntegerField(default=0)   # percent
+    message    = models.CharField(max_length=255, blank=True, default='')
+    query_id   = models.IntegerField()
+    disease    = models.CharField(max_length=100)
+    params     = models.JSONField(default=dict, blank=True)   # of the fitted tree
+    # hyperparameter search: {'mode', 'grid', 'folds', 'n_iter'}, and its
+    # results, best first (params then holds the winning parameters)
+    search      = models.JSONField(null=True, blank=True)
+    leaderboard = models.JSONField(null=True, blank=True)
+    metrics    = models.JSONField(null=True, blank=True)
+    model_path = models.CharField(max_length=255, blank=True, default='')
+    error      = models.TextField(blank=True, default='')
+    worker     = models.CharField(max_length=100, blank=True, default='')   # host:pid running it
+    created    = models.DateTimeField(auto_now_add=True)
+    updated    = models.DateTimeField(auto_now=True)
@@ -1,4 +1,5 @@
 import hashlib
+from types import MappingProxyType
 
 RAW_TEMPLATES = [
     # Level 0
@@ -262,20 +263,102 @@ ORDER BY ?anonID ?tDate''',
       'params': ['disease'],
       'description': 'Complete patient profiles for DISEASE'
     },
+    # Aggregated counterpart of the patient profiles, used to train on
+    # per-node sufficient statistics instead of rows (kept last: entry ids
+    # are positions)
+    {
+      'level': 4,
+      'template': '''SELECT ?evType ?sex (COUNT(?aOns) AS ?n) (SUM(?aOns) AS ?sum)
+       (SUM(?aOns * ?aOns) AS ?sumSq) WHERE {
+  ?pat a bto:Patient ;
+       bto:sex           ?sex ;
+       bto:undergo      ?ev ;
+       bto:hasDisease    {disease} .
+  ?ev  a ?evType ;
+       bto:ageOnset ?aOns ;
+       bto:eventStart    ?evStart .
+}
+GROUP BY ?evType ?sex''',
+      'params': ['disease'],
+      'description': 'Count, sum and sum of squares of onset ages of DISEASE patients by event type and sex',
+      'analytics_key': 'ageOnStats'
+    },
+    # Per-patient values behind true federated medians / percentiles: the
+    # central node streams them into mergeable quantile sketches
+    {
+      'level': 5,
+      'template': '''SELECT ?diff WHERE {
+  ?pat a bto:Patient ;
+       bto:hasDisease {disease} ;
+       bto:deathDate ?d .
+  ?ev  a bto:Onset ;
+       bto:eventStart ?s ;
+       bto:registeredFor ?pat .
+  FILTER ( ?s >= "{starting_date}"^^xsd:date )
+  BIND( xsd:integer(?d) - xsd:integer(?s) AS ?diff )
+}''',
+      'params': ['disease','starting_date'],
+      'description': 'Median and percentiles of survival time (days) from onset to death, after STARTING_DATE',
+      'analytics_key': 'survivalQuantiles'
+    },
+    {
+      'level': 5,
+      'template': '''SELECT ?ageOn WHERE {
+  ?pat a bto:Patient ;
+       bto:hasDisease  {disease} ;
+       bto:undergo ?ev .
+  ?ev  a bto:Onset ;
+       bto:ageOnset    ?ageOn .
+}''',
+      'params': ['disease'],
+      'description': 'Median and percentiles of the age at onset of DISEASE patients',
+      'analytics_key': 'ageOnQuantiles'
+    },
 ]
 
-def catalog():
+def _build_catalog():
+    """
+    Freeze RAW_TEMPLATES into read-only entries, hashing each template once.
+    An entry's `id` is its position in RAW_TEMPLATES.
+    """
     out = []
-    for e in RAW_TEMPLATES:
+    for idx, e in enumerate(RAW_TEMPLATES):
         h = hashlib.sha512(e['template'].encode()).hexdigest()
         entry = {
+            'id':          idx,
             'hash':        h,
             'level':       e['level'],
             'template':    e['template'],
-            'params':      e['params'],
+            'params':      tuple(e['params']),
             'description': e['description'],
         }
         if 'analytics_key' in e:
             entry['analytics_key'] = e['analytics_key']
-        out.append(entry)
-    return out
+        out.append(MappingProxyType(entry))
+    return tuple(out)
+
+
+_CATALOG          = _build_catalog()
+_BY_ID            = MappingProxyType({e['id']: e for e in _CATALOG})
+_BY_HASH          = MappingProxyType({e['hash']: e for e in _CATALOG})
+_BY_ANALYTICS_KEY = MappingProxyType({e['analytics_key']: e for e in _CATALOG if 'analytics_key' in e})
+
+
+def catalog():
+    """All the (read-only) catalog entries, in RAW_TEMPLATES order."""
+    return _CATALOG
+
+
+def by_id(idx):
+    """Entry with numeric id `idx` (raises KeyError if unknown)."""
+    return _BY_ID[int(idx)]
+
+
+def by_hash(h):
+    """Entry whose template has SHA-512 `h`, or None."""
+    return _BY_HASH.get(h)
+
+
+def by_analytics_key(key):
+    """Entry tagged with `analytics_key`, or None."""
+    return _BY_ANALYTICS_KEY.get(key)
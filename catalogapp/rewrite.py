@@ -0,0 +1,103 @@
+# catalogapp/rewrite.py
+"""
+Aggregate rewriting for exact federated means.
+
+Averages returned by each endpoint can't be combined centrally: the mean
+of per-node means is wrong unless every node holds as many rows. With the
+rewrite on, `(AVG(expr) AS ?v)` projections are dispatched as
+`(SUM(expr) AS ?v__sum) (COUNT(expr) AS ?v__count)`; the per-node mean is
+then sum / count, and the exact global mean Σsum / Σcount, computed per
+group (the other projected variables) in one vectorized pass over the
+merged answers.
+"""
+import re
+
+import pandas as pd
+
+from .columnar import numeric
+
+SUM_SUFFIX   = '__sum'
+COUNT_SUFFIX = '__count'
+
+# (AVG(expr) AS ?var), expr holding up to two levels of parentheses;
+# AVG(DISTINCT …) is left alone: distinct values can't be merged across nodes
+_AVG = re.compile(
+    r'\(\s*AVG\s*\(\s*(?!DISTINCT\b)'
+    r'(?P<expr>(?:[^()]|\((?:[^()]|\([^()]*\))*\))*?)'
+    r'\s*\)\s+AS\s+\?(?P<var>\w+)\s*\)',
+    re.IGNORECASE,
+)
+
+
+def rewrite_avg(template):
+    """
+    (template with its AVG projections turned into SUM/COUNT pairs, rewritten
+    variable names). Averages whose variable is used elsewhere in the
+    template (ORDER BY, an outer query, …) are kept as they are.
+    """
+    rewritten = []
+
+    def sub(m):
+        var = m.group('var')
+        if len(re.findall(rf'\?{var}\b', template)) > 1:
+            return m.group(0)
+        rewritten.append(var)
+        expr = m.group('expr')
+        return f'(SUM({expr}) AS ?{var}{SUM_SUFFIX}) (COUNT({expr}) AS ?{var}{COUNT_SUFFIX})'
+
+    return _AVG.sub(sub, template), rewritten
+
+
+def _count_column(var):
+    return f'{var}_n'
+
+
+def node_means(frame, avgs):
+    """
+    One endpoint's answer with each rewritten SUM/COUNT pair replaced by the
+    node's mean `var` and its row count `var_n`, in the original column order.
+    """
+    out = {}
+    for c in frame.columns:
+        var = c[:-len(SUM_SUFFIX)] if c.endswith(SUM_SUFFIX) else None
+        if var in avgs:
+            s = numeric(frame[c]).astype('float64')
+            n = numeric(frame[var + COUNT_SUFFIX]).fillna(0).astype('int64')
+            out[var] = (s / n).where(n > 0)
+            out[_count_column(var)] = n
+        elif not (c.endswith(COUNT_SUFFIX) and c[:-len(COUNT_SUFFIX)] in avgs):
+            out[c] = frame[c]
+    return pd.DataFrame(out, index=frame.index)
+
+
+def global_means(merged, avgs):
+    """
+    Exact global means of the merged per-node answers (as returned by
+    node_means, plus `endpoint`): Σ(mean·n) / Σn per group of the other
+    variables, with the total count `var_n`.
+    """
+    present = [v for v in avgs if v in merged.columns]
+    groups = [c for c in merged.columns
+              if c not in present and c not in ('endpoint', 'logo_url')
+              and c not in {_count_column(v) for v in present}]
+    if merged.empty or not present:
+        return pd.DataFrame(columns=groups + [col for v in present for col in (v, _count_column(v))])
+
+    sums = {}
+    for v in present:
+        n = merged[_count_column(v)].astype('float64')
+        sums[v] = (merged[v].astype('float64') * n).fillna(0)
+        sums[_count_column(v)] = n
+    parts = pd.DataFrame(sums)
+    if groups:
+        keys = [merged[g].astype(object).where(merged[g].notna(), None) for g in groups]
+        totals = parts.groupby(keys, sort=False, dropna=False).sum().reset_index()
+        totals.columns = groups + list(sums)
+    else:
+        totals = parts.sum().to_frame().T
+
+    for v in present:
+        n = totals[_count_column(v)]
+        totals[v] = (totals[v] / n).where(n > 0)
+        totals[_count_column(v)] = n.astype('int64')
+    return totals[groups + [col for v in present for col in (v, _count_column(v))]]
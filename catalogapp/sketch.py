@@ -0,0 +1,120 @@
+# catalogapp/sketch.py
+"""
+Mergeable quantile sketches.
+
+A TDigest summarizes any number of values in about `compression` / 2
+weighted centroids, small near the extremes and larger around the median,
+so quantiles stay accurate (relative error well under 1% of rank for the
+default compression) while memory is bounded by the sketch, not by the
+number of values. Digests built on different nodes, or from different
+chunks of a stream, merge into the digest of all their values; they travel
+as plain JSON (`to_dict` / `from_dict`).
+"""
+import math
+
+import numpy as np
+
+
+class TDigest:
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.min = math.inf
+        self.max = -math.inf
+        self._means   = np.empty(0)
+        self._weights = np.empty(0)
+        self._buffer  = []   # pending (means, weights) arrays
+        self._pending = 0
+
+    # ---- building ----------------------------------------------------------
+
+    def update(self, values, weights=None):
+        """Add a batch of values (missing / non-finite ones are ignored)."""
+        values = np.asarray(values, dtype='float64').ravel()
+        weights = (np.ones_like(values) if weights is None
+                   else np.asarray(weights, dtype='float64').ravel())
+        keep = np.isfinite(values) & (weights > 0)
+        values, weights = values[keep], weights[keep]
+        if not len(values):
+            return self
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._buffer.append((values, weights))
+        self._pending += len(values)
+        if self._pending > 10 * self.compression:
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """Fold another digest (or its to_dict form) into this one."""
+        if isinstance(other, dict):
+            other = TDigest.from_dict(other)
+        other._compress()
+        if len(other._means):
+            self._buffer.append((other._means, other._weights))
+            self._pending += len(other._means)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            if self._pending > 10 * self.compression:
+                self._compress()
+        return self
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        means   = np.concatenate([self._means] + [m for m, _ in self._buffer])
+        weights = np.concatenate([self._weights] + [w for _, w in self._buffer])
+        self._buffer, self._pending = [], 0
+
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # k1 scale function: one centroid per unit of k, so centroids hold
+        # few values near q=0 and q=1 and many around the median
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = np.floor(self.compression / (2 * math.pi) * np.arcsin(2 * q - 1))
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+        self._weights = np.add.reduceat(weights, starts)
+        self._means   = np.add.reduceat(means * weights, starts) / self._weights
+
+    # ---- querying ----------------------------------------------------------
+
+    @property
+    def count(self):
+        self._compress()
+        return float(self._weights.sum())
+
+    def quantile(self, q):
+        """Estimated q-quantile (0 <= q <= 1), NaN for an empty digest."""
+        return float(self.quantiles([q])[0])
+
+    def quantiles(self, qs):
+        self._compress()
+        if not len(self._means):
+            return np.full(len(qs), np.nan)
+        total = self._weights.sum()
+        centers = np.cumsum(self._weights) - self._weights / 2
+        return np.interp(np.asarray(qs, dtype='float64') * total,
+                         np.r_[0.0, centers, total],
+                         np.r_[self.min, self._means, self.max])
+
+    # ---- serialization -----------------------------------------------------
+
+    def to_dict(self):
+        self._compress()
+        return {
+            'compression': self.compression,
+            'min':         self.min if len(self._means) else None,
+            'max':         self.max if len(self._means) else None,
+            'centroids':   np.column_stack([self._means, self._weights]).tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(data.get('compression', 100))
+        centroids = np.asarray(data.get('centroids') or [], dtype='float64').reshape(-1, 2)
+        if len(centroids):
+            digest._means, digest._weights = centroids[:, 0].copy(), centroids[:, 1].copy()
+            digest.min = data['min'] if data.get('min') is not None else float(centroids[:, 0].min())
+            digest.max = data['max'] if data.get('max') is not None else float(centroids[:, 0].max())
+        return digest
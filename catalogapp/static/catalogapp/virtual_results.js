@@ -0,0 +1,89 @@
+// catalogapp/static/catalogapp/virtual_results.js
+// Virtual-scrolling table of a paged result set (result_page): only the
+// visible rows exist, fetched a page at a time; sorting is done on the
+// server, over the whole result set. `box` is the scrolling container of a
+// table whose header has the logo column, then one th[data-sort] per column,
+// with data-page-url, data-page-size and data-total.
+function virtualResults(box) {
+  const tbody = box.querySelector('tbody');
+  const url = box.dataset.pageUrl;
+  const pageSize = parseInt(box.dataset.pageSize, 10);
+  const width = box.querySelectorAll('thead th').length;
+  const ROW = 33, OVERSCAN = 10;
+  let total = parseInt(box.dataset.total, 10);
+  let pages = new Map(), pending = new Set(), logos = {};
+  let sort = '', desc = false, generation = 0;
+
+  function load(p) {
+    if (pages.has(p) || pending.has(p)) return;
+    pending.add(p);
+    const gen = generation;
+    const q = new URLSearchParams({offset: p * pageSize, limit: pageSize, sort: sort, desc: desc ? 1 : 0});
+    fetch(`${url}?${q}`).then(r => r.json()).then(data => {
+      if (gen !== generation) return;
+      pending.delete(p);
+      if (data.error) {
+        box.replaceWith(Object.assign(document.createElement('div'),
+                                      {className: 'alert alert-warning', textContent: data.error}));
+        return;
+      }
+      total = data.total;
+      Object.assign(logos, data.logos);
+      pages.set(p, data.rows);
+      render();
+    });
+  }
+
+  function spacer(height) {
+    const tr = document.createElement('tr');
+    const td = tr.insertCell();
+    td.colSpan = width;
+    td.style.cssText = `height:${height}px; padding:0; border:0;`;
+    return tr;
+  }
+
+  function render() {
+    const first = Math.max(0, Math.floor(box.scrollTop / ROW) - OVERSCAN);
+    const last = Math.min(total, Math.ceil((box.scrollTop + box.clientHeight) / ROW) + OVERSCAN);
+    const rows = [spacer(first * ROW)];
+    for (let i = first; i < last; i++) {
+      const page = pages.get(Math.floor(i / pageSize));
+      const row = page ? page[i % pageSize] : null;
+      const tr = document.createElement('tr');
+      tr.style.height = `${ROW}px`;
+      const logo = tr.insertCell();
+      if (row && logos[row[0]]) {
+        const img = document.createElement('img');
+        img.src = logos[row[0]];
+        img.alt = `${row[0]} logo`;
+        img.style.height = '20px';
+        logo.appendChild(img);
+      }
+      for (let c = 1; c < width; c++) {
+        const td = tr.insertCell();
+        td.style.cssText = 'white-space:nowrap; overflow:hidden; text-overflow:ellipsis;';
+        td.textContent = row ? (row[c - 1] ?? '') : '…';
+      }
+      if (!page) load(Math.floor(i / pageSize));
+      rows.push(tr);
+    }
+    rows.push(spacer((total - last) * ROW));
+    tbody.replaceChildren(...rows);
+  }
+
+  box.querySelectorAll('th[data-sort]').forEach(th => th.addEventListener('click', event => {
+    // sorted on the server, over the whole result set
+    event.stopPropagation();
+    desc = sort === th.dataset.sort ? !desc : false;
+    sort = th.dataset.sort;
+    box.querySelectorAll('th[data-sort]').forEach(h => h.setAttribute('aria-sort', 'none'));
+    th.setAttribute('aria-sort', desc ? 'descending' : 'ascending');
+    generation++;
+    pages = new Map();
+    pending = new Set();
+    box.scrollTop = 0;
+    render();
+  }));
+  box.addEventListener('scroll', () => requestAnimationFrame(render));
+  render();
+}
@@ -0,0 +1,102 @@
+# catalogapp/tests/test_columnar.py
+import pandas as pd
+import pyarrow as pa
+from django.test import SimpleTestCase
+
+from catalogapp.columnar import XSD, decode_column, frame_from_sparql, merge
+
+
+class DecodeColumnTests(SimpleTestCase):
+
+    def test_integers(self):
+        column = decode_column(['1', '42', None], {XSD + 'integer'})
+        self.assertEqual(str(column.dtype), 'Int64')
+        self.assertEqual(column.tolist(), [1, 42, pd.NA])
+
+    def test_non_integral_integer_is_missing(self):
+        column = decode_column(['1', '2.5', 'x'], {XSD + 'integer'})
+        self.assertEqual(column.tolist(), [1, pd.NA, pd.NA])
+
+    def test_decimals(self):
+        column = decode_column(['1.5', '2'], {XSD + 'decimal'})
+        self.assertEqual(column.dtype, 'float64')
+        self.assertEqual(column.tolist(), [1.5, 2.0])
+
+    def test_date_times_of_mixed_precision(self):
+        column = decode_column(['2020-01-01T10:00:00Z', '2020-01-01T10:00:00.123Z',
+                                '2020-01-01T12:00:00+02:00'], {XSD + 'dateTime'})
+        self.assertEqual(column.tolist(), [
+            pd.Timestamp('2020-01-01T10:00:00Z'),
+            pd.Timestamp('2020-01-01T10:00:00.123Z'),
+            pd.Timestamp('2020-01-01T10:00:00Z'),
+        ])
+
+    def test_dates_with_timezone(self):
+        column = decode_column(['2020-01-01', '2020-01-02Z', '2020-01-03+02:00'], {XSD + 'date'})
+        self.assertEqual(column.dt.day.tolist(), [1, 2, 3])
+
+    def test_booleans(self):
+        column = decode_column(['true', '0', None], {XSD + 'boolean'})
+        self.assertEqual(column.tolist(), [True, False, pd.NA])
+
+    def test_mixed_or_missing_datatypes_stay_strings(self):
+        self.assertEqual(decode_column(['1', 'a'], {XSD + 'integer', None}).tolist(), ['1', 'a'])
+        self.assertEqual(decode_column(['1'], {None}).tolist(), ['1'])
+
+
+class FrameFromSparqlTests(SimpleTestCase):
+
+    def test_unbound_values_are_missing(self):
+        frame = frame_from_sparql({
+            'head': {'vars': ['a', 'n']},
+            'results': {'bindings': iter([
+                {'a': {'type': 'literal', 'value': 'x'},
+                 'n': {'type': 'literal', 'datatype': XSD + 'integer', 'value': '3'}},
+                {'a': {'type': 'literal', 'value': 'y'}},
+            ])},
+        })
+        self.assertEqual(list(frame.columns), ['a', 'n'])
+        self.assertEqual(frame['n'].tolist(), [3, pd.NA])
+
+    def test_plain_cells(self):
+        frame = frame_from_sparql({
+            'head': {'vars': ['n']},
+            'results': {'bindings': [{'n': '3'}, {'n': {'type': 'literal', 'value': '4'}}]},
+        })
+        self.assertEqual(frame['n'].tolist(), ['3', '4'])
+
+    def test_malformed_answer(self):
+        with self.assertRaises(AttributeError):
+            frame_from_sparql({'head': {'vars': ['n']}, 'results': [{'n': '3'}]})
+
+
+def answer(*rows):
+    """A SPARQL JSON SELECT answer binding `n` and `d` (None when unbound)."""
+    bindings = [{v: cell for v, cell in zip(('n', 'd'), row) if cell is not None} for row in rows]
+    return frame_from_sparql({'head': {'vars': ['n', 'd']}, 'results': {'bindings': bindings}})
+
+
+class MergeTests(SimpleTestCase):
+
+    typed   = {'value': '3', 'datatype': XSD + 'integer'}
+    untyped = {'value': '4'}
+    date    = {'value': '2020-01-01', 'datatype': XSD + 'date'}
+
+    def test_conflicting_dtypes_merge_as_text(self):
+        merged = merge([('a', None, answer((self.typed, self.date))),
+                        ('b', None, answer((self.untyped, {'value': 'x'})))])
+        self.assertEqual(merged['n'].tolist(), ['3', '4'])
+        self.assertEqual(merged['d'].tolist(), ['2020-01-01', 'x'])
+        pa.Table.from_pandas(merged)   # storable in the frame cache
+
+    def test_unbound_parts_keep_the_dtype(self):
+        merged = merge([('a', None, answer((self.typed, self.date))),
+                        ('b', None, answer((None, None)))])
+        self.assertEqual(str(merged['n'].dtype), 'Int64')
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(merged['d']))
+        self.assertEqual(merged['n'].tolist(), [3, pd.NA])
+
+    def test_numbers_widen(self):
+        merged = merge([('a', None, answer((self.typed, None))),
+                        ('b', None, pd.DataFrame({'n': [2.5]}))])
+        self.assertEqual(merged['n'].tolist(), [3.0, 2.5])
@@ -0,0 +1,97 @@
+# catalogapp/tests/test_export.py
+import io
+import json
+
+import pandas as pd
+import pyarrow.parquet as pq
+from django.test import SimpleTestCase
+
+from catalogapp import export
+from catalogapp.columnar import XSD, frame_from_sparql
+
+
+def answer(*values, datatype=None):
+    """One endpoint's SPARQL answer binding `n` (None when unbound) and `s`."""
+    bindings = [{'s': {'type': 'literal', 'value': f"s{i}"}} for i in range(len(values))]
+    for bd, value in zip(bindings, values):
+        if value is not None:
+            bd['n'] = {'type': 'literal', 'value': value, **({'datatype': datatype} if datatype else {})}
+    return frame_from_sparql({'head': {'vars': ['n', 's']}, 'results': {'bindings': bindings}})
+
+
+def chunks(*items):
+    yield from items
+
+
+def parquet(*items):
+    return pq.read_table(io.BytesIO(b''.join(export.parquet_stream(chunks(*items)))))
+
+
+class WriterTests(SimpleTestCase):
+
+    def test_csv(self):
+        out = ''.join(export.csv_stream(chunks(
+            ('a', answer('1', '2', datatype=XSD + 'integer')),
+            ('b', answer('3', datatype=XSD + 'integer')[['s', 'n']]),
+        )))
+        self.assertEqual(out.splitlines(), ['endpoint,n,s', 'a,1,s0', 'a,2,s1', 'b,3,s0'])
+
+    def test_dates_as_in_ndjson(self):
+        frame = frame_from_sparql({'head': {'vars': ['d', 't']}, 'results': {'bindings': [{
+            'd': {'type': 'literal', 'value': '2020-01-01', 'datatype': XSD + 'date'},
+            't': {'type': 'literal', 'value': '2020-01-01T10:00:00Z', 'datatype': XSD + 'dateTime'},
+        }]}})
+        csv = ''.join(export.csv_stream(chunks(('a', frame.copy()))))
+        ndjson = json.loads(''.join(export.ndjson_stream(chunks(('a', frame.copy())))))
+        self.assertEqual(csv.splitlines()[1], f"a,{ndjson['d']},{ndjson['t']}")
+        self.assertEqual(ndjson['d'], '2020-01-01')
+
+    def test_ndjson(self):
+        out = ''.join(export.ndjson_stream(chunks(('a', answer('1', None, datatype=XSD + 'integer')))))
+        self.assertEqual([json.loads(line) for line in out.splitlines()],
+                         [{'endpoint': 'a', 'n': 1, 's': 's0'}, {'endpoint': 'a', 'n': None, 's': 's1'}])
+
+    def test_parquet_round_trip(self):
+        table = parquet(('a', answer('1', None, datatype=XSD + 'integer')),
+                        ('b', answer('3', datatype=XSD + 'integer')))
+        frame = table.to_pandas()
+        self.assertEqual(str(frame['n'].dtype), 'Int64')
+        self.assertEqual(frame['n'].tolist(), [1, pd.NA, 3])
+        self.assertEqual(frame['endpoint'].tolist(), ['a', 'a', 'b'])
+
+    def test_parquet_empty_first_chunk(self):
+        table = parquet(('a', answer()), ('b', answer('1', '2', datatype=XSD + 'integer')))
+        self.assertEqual(table.column('n').to_pylist(), [1, 2])
+        self.assertEqual(table.column('s').to_pylist(), ['s0', 's1'])
+
+    def test_parquet_typed_and_untyped_nodes(self):
+        table = parquet(('a', answer('1', datatype=XSD + 'integer')), ('b', answer('2')))
+        self.assertEqual(table.column('n').to_pylist(), [1, 2])
+        table = parquet(('b', answer('2')), ('a', answer('1', datatype=XSD + 'integer')))
+        self.assertEqual(table.column('n').to_pylist(), ['2', '1'])
+
+    def test_parquet_unbound_first_column_is_text(self):
+        table = parquet(('a', answer(None)), ('b', answer('x')))
+        self.assertEqual(table.column('n').to_pylist(), [None, 'x'])
+
+    def test_parquet_value_that_does_not_fit_aborts(self):
+        with self.assertRaisesRegex(ValueError, "Column 'n' doesn't fit int64"):
+            parquet(('a', answer('1', datatype=XSD + 'integer')), ('b', answer('abc')))
+
+    def test_parquet_without_rows(self):
+        table = parquet(('a', answer()))
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.column_names, ['endpoint', 'n', 's'])
+
+    def test_failed_endpoint_in_ndjson(self):
+        out = ''.join(export.ndjson_stream(chunks(('a', answer('1')), export.Failed('b', 'timeout'))))
+        self.assertEqual(json.loads(out.splitlines()[-1]), {'endpoint': 'b', 'error': 'timeout'})
+
+    def test_failed_endpoint_in_parquet_footer(self):
+        data = b''.join(export.parquet_stream(chunks(('a', answer('1')), export.Failed('b', 'timeout'))))
+        footer = pq.read_metadata(io.BytesIO(data)).metadata
+        self.assertEqual(json.loads(footer[b'failed_endpoints']), [{'endpoint': 'b', 'error': 'timeout'}])
+
+    def test_failed_endpoint_aborts_csv(self):
+        with self.assertRaises(ValueError):
+            ''.join(export.csv_stream(chunks(('a', answer('1')), export.Failed('b', 'timeout'))))
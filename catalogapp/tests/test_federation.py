@@ -0,0 +1,37 @@
+# catalogapp/tests/test_federation.py
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from catalogapp import breaker, federation
+
+
+class CancelledCallTests(SimpleTestCase):
+
+    def setUp(self):
+        self.ep = SimpleNamespace(pk='test-endpoint', url='http://node.invalid/api', name='node')
+        breaker.reset(self.ep.pk)
+        self.addCleanup(breaker.reset, self.ep.pk)
+
+    def fan_out(self, error=None, **kwargs):
+        result = federation.EndpointResult(self.ep, data={} if error is None else None, error=error)
+        with mock.patch.object(federation, '_post', return_value=result):
+            return federation.fan_out([self.ep], 'ASK {}', 'ASK {}', parse=lambda resp: None, **kwargs)
+
+    def test_cancelled_calls_leave_the_breaker_closed(self):
+        for _ in range(5):
+            self.fan_out(federation.Cancelled('export cancelled'))
+        b = breaker.breaker_for(self.ep)
+        self.assertEqual((b.state, b.failures), (breaker.CLOSED, 0))
+
+    def test_failures_still_count(self):
+        for _ in range(5):
+            self.fan_out(ValueError('bad answer'))
+        self.assertEqual(breaker.breaker_for(self.ep).state, breaker.OPEN)
+
+    def test_untimed_calls_keep_out_of_the_latencies(self):
+        self.fan_out(timed=False)
+        self.assertEqual(breaker.breaker_for(self.ep).latencies, {})
+        self.fan_out()
+        self.assertEqual(len(breaker.breaker_for(self.ep).latencies['ASK {}']), 1)
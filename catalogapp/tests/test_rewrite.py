@@ -0,0 +1,63 @@
+# catalogapp/tests/test_rewrite.py
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from catalogapp import columnar
+from catalogapp.rewrite import global_means, node_means, rewrite_avg
+
+
+class RewriteAvgTests(SimpleTestCase):
+
+    def test_avg_becomes_sum_and_count(self):
+        template, avgs = rewrite_avg('SELECT ?site (AVG(?age) AS ?avgAge) WHERE { … } GROUP BY ?site')
+        self.assertEqual(avgs, ['avgAge'])
+        self.assertIn('(SUM(?age) AS ?avgAge__sum) (COUNT(?age) AS ?avgAge__count)', template)
+        self.assertNotIn('AVG', template)
+
+    def test_nested_expression(self):
+        template, avgs = rewrite_avg('SELECT (avg(xsd:integer(STR(?a))) AS ?m) WHERE { }')
+        self.assertEqual(avgs, ['m'])
+        self.assertIn('(SUM(xsd:integer(STR(?a))) AS ?m__sum)', template)
+
+    def test_untouched_averages(self):
+        for template in [
+            'SELECT (AVG(DISTINCT ?a) AS ?m) WHERE { }',              # can't be merged
+            'SELECT (AVG(?a) AS ?m) WHERE { } ORDER BY ?m',           # used elsewhere
+            'SELECT (SUM(?a) AS ?s) WHERE { }',
+        ]:
+            self.assertEqual(rewrite_avg(template), (template, []))
+
+
+class MeansTests(SimpleTestCase):
+
+    def answer(self, sites, sums, counts):
+        return pd.DataFrame({'site': sites, 'm__sum': sums, 'm__count': counts})
+
+    def test_node_means(self):
+        frame = node_means(self.answer(['a', 'b'], [10.0, 0.0], [4, 0]), ['m'])
+        self.assertEqual(list(frame.columns), ['site', 'm', 'm_n'])
+        self.assertEqual(frame['m'].tolist()[0], 2.5)
+        self.assertTrue(np.isnan(frame['m'].tolist()[1]))
+        self.assertEqual(frame['m_n'].tolist(), [4, 0])
+
+    def test_exact_global_means(self):
+        # node 1: site a = [1, 2, 3], site b = [10]; node 2: site a = [7]
+        merged = columnar.merge([
+            ('n1', None, node_means(self.answer(['a', 'b'], [6.0, 10.0], [3, 1]), ['m'])),
+            ('n2', None, node_means(self.answer(['a'], [7.0], [1]), ['m'])),
+        ])
+        out = global_means(merged, ['m']).set_index('site')
+        self.assertEqual(out.loc['a', 'm'], (1 + 2 + 3 + 7) / 4)   # not the mean of means (2 + 7) / 2
+        self.assertEqual(out.loc['a', 'm_n'], 4)
+        self.assertEqual(out.loc['b', 'm'], 10)
+
+    def test_without_groups_or_answers(self):
+        merged = columnar.merge([
+            ('n1', None, node_means(pd.DataFrame({'m__sum': [6.0], 'm__count': [3]}), ['m'])),
+            ('n2', None, node_means(pd.DataFrame({'m__sum': [4.0], 'm__count': [1]}), ['m'])),
+        ])
+        out = global_means(merged, ['m'])
+        self.assertEqual(out['m'].tolist(), [2.5])
+        self.assertEqual(out['m_n'].tolist(), [4])
+        self.assertTrue(global_means(columnar.merge([]), ['m']).empty)
@@ -0,0 +1,71 @@
+# catalogapp/tests/test_sketch.py
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from catalogapp import analytics
+from catalogapp.sketch import TDigest
+
+QS = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+class TDigestTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # nodes of very different sizes and distributions
+        self.parts = [rng.normal(50, 10, 20000), rng.exponential(20, 5000), rng.uniform(0, 100, 300)]
+        self.values = np.concatenate(self.parts)
+
+    def assertRankClose(self, estimates, values, tolerance=0.01):
+        """Each estimate's rank among `values` is within `tolerance` of its quantile."""
+        ordered = np.sort(values)
+        for q, estimate in zip(QS, estimates):
+            rank = np.searchsorted(ordered, estimate) / len(ordered)
+            self.assertLess(abs(rank - q), tolerance, f"q={q}: rank {rank:.4f}")
+
+    def test_single_stream(self):
+        digest = TDigest()
+        for chunk in np.array_split(self.values, 50):
+            digest.update(chunk)
+        self.assertEqual(digest.count, len(self.values))
+        self.assertRankClose(digest.quantiles(QS), self.values)
+
+    def test_merged_digests(self):
+        total = TDigest()
+        for part in self.parts:
+            total.merge(TDigest().update(part))
+        self.assertEqual(total.count, len(self.values))
+        self.assertRankClose(total.quantiles(QS), self.values)
+        self.assertEqual(total.quantile(0), self.values.min())
+        self.assertEqual(total.quantile(1), self.values.max())
+
+    def test_json_round_trip(self):
+        digest = TDigest().update(self.values)
+        restored = TDigest.from_dict(digest.to_dict())
+        np.testing.assert_allclose(restored.quantiles(QS), digest.quantiles(QS))
+
+    def test_missing_values_and_empty_digest(self):
+        digest = TDigest().update([1.0, np.nan, np.inf, 3.0])
+        self.assertEqual(digest.count, 2)
+        self.assertTrue(np.isnan(TDigest().quantile(0.5)))
+        self.assertEqual(TDigest.from_dict(TDigest().to_dict()).count, 0)
+
+
+class QuantilesOperatorTests(SimpleTestCase):
+
+    def test_merge_of_node_sketches(self):
+        op = analytics.quantiles('ageOn', qs=(0.5,))
+        frame = pd.DataFrame({
+            'endpoint': ['a', 'b'],
+            'sketch':   [TDigest().update(np.arange(100)).to_dict(),
+                         TDigest().update(np.arange(100, 300)).to_dict()],
+        })
+        out = op.merge(frame)
+        self.assertEqual(out['n'], 300)
+        self.assertAlmostEqual(out['results'][0]['value'], 149.5, delta=1.5)
+        self.assertEqual([node['n'] for node in out['per_node']], [100, 200])
+
+    def test_no_answers(self):
+        out = analytics.quantiles('ageOn', qs=(0.5,)).merge(pd.DataFrame({'endpoint': [], 'sketch': []}))
+        self.assertEqual(out, {'results': [{'quantile': 0.5, 'value': None}], 'n': 0, 'per_node': []})
@@ -0,0 +1,93 @@
+# catalogapp/tests/test_training.py
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+from sklearn.pipeline import Pipeline
+
+from catalogapp import training
+
+
+def patient_rows(seed=0, n=600):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'evType':   rng.choice(['Onset', 'Diagnosis', 'Death'], n),
+        'sex':      rng.choice(['Male', 'Female'], n),
+        'endpoint': rng.choice(['node0', 'node1', 'node2', 'node3'], n, p=[0.6, 0.2, 0.15, 0.05]),
+        'ageOn':    rng.normal(55, 12, n).round(),
+    })
+
+
+def aggregated(rows):
+    """The per-group count, sum and sum of squares the nodes return with aggregate=1."""
+    groups = rows.assign(sq=rows['ageOn'] ** 2).groupby(training.FEATURES, as_index=False)
+    return groups.agg(n=('ageOn', 'size'), sum=('ageOn', 'sum'), sumSq=('sq', 'sum'))
+
+
+class AggregateTrainingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.rows = patient_rows()
+        self.groups = aggregated(self.rows)
+        enc = training.make_encoder().fit(training.features(self.rows))
+        self.X_rows = enc.transform(training.features(self.rows))
+        self.X_groups = enc.transform(training.features(self.groups))
+
+    def fit(self, params):
+        y, w, _ = training.targets(self.rows)
+        by_rows = training.make_tree(params, w).fit(self.X_rows, y, sample_weight=w)
+        y, w, _ = training.targets(self.groups)
+        by_groups = training.make_tree(params, w).fit(self.X_groups, y, sample_weight=w)
+        return by_rows, by_groups
+
+    def assertSamePredictions(self, params):
+        by_rows, by_groups = self.fit(params)
+        np.testing.assert_allclose(by_groups.predict(self.X_rows), by_rows.predict(self.X_rows))
+
+    def test_targets_of_groups(self):
+        y, w, sq = training.targets(self.groups)
+        self.assertEqual(w.sum(), len(self.rows))
+        self.assertAlmostEqual(float(np.sum(w * y)), float(self.rows['ageOn'].sum()))
+        self.assertAlmostEqual(float(sq.sum()), float((self.rows['ageOn'] ** 2).sum()))
+
+    def test_same_tree_as_on_rows(self):
+        self.assertSamePredictions({'random_state': 0})
+        self.assertSamePredictions({'max_depth': 2, 'random_state': 0})
+        self.assertSamePredictions({'max_features': 2, 'random_state': 0})
+
+    def test_group_criteria(self):
+        for criterion in ('squared_error', 'poisson'):   # friedman_mse is squared_error
+            self.assertSamePredictions({'criterion': criterion, 'max_depth': 3, 'random_state': 0})
+
+    def test_samples_count_patients(self):
+        y, w, _ = training.targets(self.groups)
+        tree = training.make_tree({'max_depth': 2}, w).fit(self.X_groups, y, sample_weight=w)
+        model = Pipeline([('encode', training.make_encoder().fit(training.features(self.rows))),
+                          ('tree', tree)])
+        self.assertEqual(training.tree_structure(model)['samples'], len(self.rows))
+
+    def test_min_samples_leaf_counts_patients(self):
+        self.assertSamePredictions({'min_samples_leaf': 40, 'random_state': 0})
+        self.assertSamePredictions({'min_samples_leaf': 0.1, 'random_state': 0})
+
+    def test_exact_scores_from_sums_of_squares(self):
+        by_rows, by_groups = self.fit({'max_depth': 2, 'random_state': 0})
+        y, w, sq = training.targets(self.groups)
+        from_groups = training.scores(y, w, sq, by_groups.predict(self.X_groups))
+
+        y = training.target(self.rows)
+        pred = by_rows.predict(self.X_rows)
+        mse = np.mean((y - pred) ** 2)
+        self.assertAlmostEqual(from_groups['MSE'], mse)
+        self.assertAlmostEqual(from_groups['R^2'], 1 - mse / np.var(y))
+
+    def test_scores_of_rows(self):
+        y = np.array([1.0, 2.0, 3.0])
+        scores = training.scores(y, np.ones(3), y ** 2, np.array([1.0, 2.0, 4.0]))
+        self.assertAlmostEqual(scores['MSE'], 1 / 3)
+        self.assertAlmostEqual(scores['R^2'], 1 - 1 / 2)
+
+    def test_r2_of_constant_target_is_none(self):
+        y = np.array([2.0, 2.0])
+        scores = training.scores(y, np.ones(2), y ** 2, np.array([2.0, 3.0]))
+        self.assertAlmostEqual(scores['MSE'], 1 / 2)
+        self.assertIsNone(scores['R^2'])
@@ -0,0 +1,245 @@
+# catalogapp/training.py
+"""
+Model fitting, kept free of Django imports so it can run in the worker
+processes of catalogapp.jobs.
+"""
+import functools
+import io
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import KFold, ParameterGrid, ParameterSampler, train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder
+from sklearn.tree import DecisionTreeRegressor, plot_tree
+
+FEATURES   = ['evType', 'sex', 'endpoint']
+TARGET     = 'ageOn'
+AGGREGATES = ('n', 'sum', 'sumSq')   # count, sum and sum of squares of TARGET per group
+# split criteria for which weighted group means give the tree of the rows
+# (absolute_error needs the rows' medians, which the groups don't have)
+GROUP_CRITERIA = ('squared_error', 'friedman_mse', 'poisson')
+
+
+def make_encoder(kind='onehot', sparse=False):
+    """
+    Unfitted encoder of the FEATURES columns: 'onehot' (optionally with
+    scipy sparse output) or 'ordinal'. Once fitted its category vocabulary
+    is fixed; categories not seen at fit time encode as all zeros (one-hot)
+    or -1 (ordinal).
+    """
+    if kind == 'onehot':
+        return OneHotEncoder(handle_unknown='ignore', sparse_output=sparse, dtype=np.float64)
+    if kind == 'ordinal':
+        return OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1,
+                              dtype=np.float64)
+    raise ValueError(f"Unknown encoder {kind!r}")
+
+
+def features(samples):
+    """The FEATURES columns of a DataFrame as the array the encoder expects."""
+    return samples[FEATURES].astype(str).to_numpy(dtype=object)
+
+
+def predict(model, samples):
+    """Predictions of a fitted model (encoder + tree) for a DataFrame of samples."""
+    return model.predict(features(samples))
+
+
+def target(df):
+    """The ageOn column as floats (it is already decoded from its xsd datatype at ingest)."""
+    if 'aOns' in df.columns and TARGET not in df.columns:
+        df = df.rename(columns={'aOns': TARGET})
+    return pd.to_numeric(df[TARGET], errors='coerce').astype('float64').to_numpy()
+
+
+def is_aggregated(df):
+    """True for frames of per-group sufficient statistics (see `targets`)."""
+    return all(c in df.columns for c in AGGREGATES)
+
+
+def targets(df):
+    """
+    (y, w, sq) arrays the tree is fitted and scored on. For patient rows:
+    ageOn, weight 1 and ageOn². For aggregated frames (one row per
+    evType/sex/endpoint group with its count `n`, `sum` and `sumSq` of
+    ageOn): the group mean, weighted by n, and the group's sum of squares.
+
+    Patients of a group share all their features, so no tree can separate
+    them: a tree of one of GROUP_CRITERIA fitted on the weighted group means
+    makes the same splits, and predicts the same values, as one fitted on the rows,
+    as long as its limits are stated in patients (see `make_tree`; only
+    min_samples_split can't be, and counts groups). Holdout and CV folds
+    draw whole groups, not patients.
+    """
+    if not is_aggregated(df):
+        y = target(df)
+        return y, np.ones_like(y), y ** 2
+    n, total, sq = (pd.to_numeric(df[c], errors='coerce').astype('float64').to_numpy()
+                    for c in AGGREGATES)
+    return total / n, n, sq
+
+
+def scores(y, w, sq, pred):
+    """
+    Exact MSE and R² over the underlying rows, from (y, w, sq) and the
+    predictions: sum((x - p)²) = sq - 2·p·w·y + w·p² within each group.
+    R² is None for a constant target (JSON has no NaN).
+    """
+    sse   = float(np.sum(sq - 2 * pred * w * y + w * pred ** 2))
+    count = float(np.sum(w))
+    sst   = float(np.sum(sq) - np.sum(w * y) ** 2 / count)
+    return {'MSE': sse / count, 'R^2': 1 - sse / sst if sst else None}
+
+
+def make_tree(params, w):
+    """
+    Unfitted DecisionTreeRegressor for training rows of weights `w`. On
+    groups (weights above 1) min_samples_leaf would count groups, not
+    patients: it is enforced as the equivalent min_weight_fraction_leaf.
+    """
+    leaf = params.get('min_samples_leaf', 1)
+    if np.all(w == 1) or leaf == 1:
+        return DecisionTreeRegressor(**params)
+    fraction = leaf if isinstance(leaf, float) else leaf / float(np.sum(w))
+    return DecisionTreeRegressor(**{
+        **params,
+        'min_samples_leaf': 1,
+        # sklearn caps the fraction at 0.5, where no split is possible anyway
+        'min_weight_fraction_leaf': min(0.5, max(fraction, params.get('min_weight_fraction_leaf', 0.0))),
+    })
+
+
+def fit_tree(df, params, model_path, encoder='onehot', sparse=False):
+    """
+    Fit a DecisionTreeRegressor of ageOn on the encoded FEATURES of patient
+    rows or of aggregated groups (see `targets`), save the fitted encoder
+    and tree as one Pipeline to `model_path` and return
+    {'metrics': …, 'n_rows': …} (n_rows counts patient rows either way).
+    """
+    # 1) encode categorical cols; the vocabulary is fixed here, once, and
+    #    the same fitted encoder is applied again at predict time
+    enc = make_encoder(encoder, sparse).fit(features(df))
+    X = enc.transform(features(df))
+    y, w, sq = targets(df)
+
+    # 2) train/test split (of rows, or of whole groups)
+    train, test = train_test_split(
+        np.arange(len(y)), test_size=0.3, random_state=params.get('random_state', 42)
+    )
+
+    tree = make_tree(params, w[train])
+    tree.fit(X[train], y[train], sample_weight=w[train])
+
+    # 3) metrics
+    metrics = scores(y[test], w[test], sq[test], tree.predict(X[test]))
+
+    # 4) persist encoder + tree for predict_model (the tree is drawn lazily,
+    #    see tree_structure / render_tree)
+    joblib.dump(Pipeline([('encode', enc), ('tree', tree)]), model_path)
+
+    return {'metrics': metrics, 'n_rows': int(w.sum())}
+
+
+def candidates(grid, mode='grid', n_iter=10, seed=42):
+    """
+    Parameter dicts to evaluate: every combination of the `grid` value lists
+    ('grid'), or `n_iter` combinations drawn at random ('random').
+    """
+    if mode == 'grid':
+        return list(ParameterGrid(grid))
+    if mode == 'random':
+        n_iter = min(n_iter, len(ParameterGrid(grid)))
+        return list(ParameterSampler(grid, n_iter, random_state=seed))
+    raise ValueError(f"Unknown search mode {mode!r}")
+
+
+def save_dataset(df, path, encoder='onehot', sparse=False):
+    """
+    Encode `df` once and dump (X, y, w, sq) to `path`, uncompressed so that
+    search workers memory-map it instead of each receiving a pickled copy.
+    """
+    X = make_encoder(encoder, sparse).fit_transform(features(df))
+    joblib.dump((X, *targets(df)), path)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_dataset(path):
+    return joblib.load(path, mmap_mode='r')
+
+
+def cv_score(dataset_path, params, folds=5, seed=42):
+    """
+    k-fold cross-validation of a tree with `params` on a save_dataset file:
+    {'params', 'MSE', 'MSE_std', 'R^2', 'fit_time', 'seconds'} (means over folds,
+    R² over those whose target isn't constant;
+    fit_time sums the fits, seconds is the wall time of the whole candidate).
+    """
+    start = time.perf_counter()
+    X, y, w, sq = _load_dataset(dataset_path)
+    folds_scores, fit_time = [], 0.0
+    for train, test in KFold(folds, shuffle=True, random_state=seed).split(X):
+        tree = make_tree(params, w[train])
+        t = time.perf_counter()
+        tree.fit(X[train], y[train], sample_weight=w[train])
+        fit_time += time.perf_counter() - t
+        folds_scores.append(scores(y[test], w[test], sq[test], tree.predict(X[test])))
+    mse = np.array([f['MSE'] for f in folds_scores])
+    r2 = [f['R^2'] for f in folds_scores if f['R^2'] is not None]
+    return {
+        'params':   params,
+        'MSE':      float(mse.mean()),
+        'MSE_std':  float(mse.std()),
+        'R^2':      float(np.mean(r2)) if r2 else None,
+        'fit_time': fit_time,
+        'seconds':  time.perf_counter() - start,
+    }
+
+
+def _feature_names(model):
+    return list(model.named_steps['encode'].get_feature_names_out(FEATURES))
+
+
+def tree_structure(model):
+    """
+    The fitted tree as nested JSON-friendly dicts, for the browser to draw:
+      {'samples', 'value', 'impurity'}                       – leaf
+      {…, 'feature', 'threshold', 'left', 'right'}           – split (left: feature <= threshold)
+    `samples` counts patients, also for a tree fitted on groups.
+    """
+    t = model.named_steps['tree'].tree_
+    names = _feature_names(model)
+
+    def node(i):
+        out = {
+            'samples':  int(round(t.weighted_n_node_samples[i])),
+            'value':    float(t.value[i][0][0]),
+            'impurity': float(t.impurity[i]),
+        }
+        if t.children_left[i] != t.children_right[i]:
+            out.update(feature=names[t.feature[i]], threshold=float(t.threshold[i]),
+                       left=node(t.children_left[i]), right=node(t.children_right[i]))
+        return out
+
+    return node(0)
+
+
+def render_tree(model, fmt='png'):
+    """The fitted tree drawn with matplotlib, as `fmt` ('png' or 'svg') bytes."""
+    # an explicit Agg canvas rather than pyplot's global figure state;
+    # pin the backend too, as plot_tree may import pyplot on its own
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10,6))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    plot_tree(model.named_steps['tree'], feature_names=_feature_names(model), filled=True, ax=ax)
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt)
+    return buf.getvalue()
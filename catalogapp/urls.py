@@ -4,12 +4,21 @@ from . import views
 urlpatterns = [
     path('',              views.central_catalog,      name='central_catalog'),
     path('query/',     views.query_view,   name='central_query'),
+    path('query/results/<slug:result_id>/', views.result_page, name='result_page'),
+    path('query/export/', views.export_results, name='export_results'),
     # endpoint manager
     path('manager/',            views.endpoint_manager, name='endpoint_manager'),
+    path('manager/status/',     views.endpoint_status,  name='endpoint_status'),
     path('manager/add/',        views.endpoint_add,     name='endpoint_add'),
     path('manager/<int:pk>/edit/',   views.endpoint_edit,    name='endpoint_edit'),
     path('manager/<int:pk>/delete/', views.endpoint_delete,  name='endpoint_delete'),
+    path('manager/cache/clear/',     views.cache_clear,      name='cache_clear'),
     path('run_analytics/', views.run_analytics, name='run_analytics'),
+    path('warehouse/', views.warehouse_sql, name='warehouse_sql'),
     path('train-model/', views.train_model, name='train_model'),
+    path('train-model/<uuid:job_id>/', views.training_job, name='training_job'),
     path('predict-model/', views.predict_model, name='predict_model'),
+    path('predict-model/batch/', views.predict_batch, name='predict_batch'),
+    path('models/<uuid:model_id>/tree/', views.model_tree, name='model_tree'),
+    path('models/<uuid:model_id>/tree.<str:fmt>', views.model_tree_image, name='model_tree_image'),
 ]
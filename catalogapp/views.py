@@ -1,37 +1,36 @@
 # catalogapp/views.py
-import duckdb
-import requests
-from urllib.parse import urlparse, urljoin
-import urllib.parse
+import io
 from django.shortcuts      import render, redirect, get_object_or_404
 from django.conf           import settings
 from django.contrib        import messages
 from django.views.decorators.http import require_http_methods
-from requests_toolbelt.utils import dump
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 import json
-from functools import wraps
-import numpy as np
-from math import log
-
-from .queries              import catalog
-from .models               import Endpoint
+import uuid
+from contextlib import contextmanager
+from functools import partial, wraps
+
+from .queries              import catalog, by_id, by_analytics_key
+from .federation           import fan_out, iter_fan_out, reset_session
+from . import analytics
+from . import cache as result_cache
+from . import health
+from . import breaker
+from . import columnar
+from . import export
+from . import frame_cache
+from . import jobs
+from . import rewrite
+from . import training
+from . import warehouse
+from .models               import Endpoint, TrainingJob
 from .forms                import QueryForm, EndpointForm
 from .forms import QUESTION_CHOICES
-import base64
-import io
 import pandas as pd
 from django.views.decorators.http import require_POST
-from django.http import JsonResponse
-from sklearn.tree import DecisionTreeRegressor, plot_tree
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.metrics import mean_squared_error, r2_score
-import uuid
-import matplotlib.pyplot as plt
-
-# simple in‐memory store for trained models
-_models = {}
+from django.urls import reverse
+from django.utils.http import urlencode
 
 TREE_PARAMS = [
     'criterion',
@@ -75,44 +74,30 @@ def require_manager_password(view_func):
 @require_manager_password
 def endpoint_manager(request):
     """
-    List all endpoints with Add / Edit / Delete links,
-    and check whether each one is up.
+    List all endpoints with Add / Edit / Delete links, and whether each
+    one is up according to the background health monitor.
     """
-    eps = []
-    for ep in Endpoint.objects.all():
-        parsed = urlparse(ep.url)
-
-        # 1) take scheme + netloc
-        base_netloc = f"{parsed.scheme}://{parsed.netloc}"
-
-        # 2) take whatever “path” was in the original URL (e.g. "/api3"),
-        #    but strip any trailing slash so we don’t get "//sparql‐protected"
-        prefix = parsed.path.rstrip("/")
-
-        # 3) build the "sparql‐protected" URL under that path:
-        #    e.g. "http://tdn.dei.unipd.it" + "/api3" + "/sparql‐protected/"
-        protected_path = prefix + "/sparql-protected/"
-
-        # urljoin will handle a missing leading slash in protected_path,
-        # but since we constructed protected_path with a leading slash
-        # (because parsed.path always starts with "/"), urljoin is straightforward:
-        base = urljoin(base_netloc, protected_path)
-
-        try:
-            resp = requests.get(base, timeout=2)
-            # if the SPARQL‐protected URL exists but only accepts POST/PUT/etc,
-            # you’ll often get 405 Method Not Allowed, which we treat as “online”
-            ep.online = (resp.status_code == 405)
-        except requests.RequestException:
-            ep.online = False
-
-        eps.append(ep)
+    health.ensure_monitor()
+    eps = list(Endpoint.objects.select_related('health'))
+    for ep in eps:
+        ep.status = health.status(ep)
 
     return render(request, 'catalogapp/endpoint_manager.html', {
         'endpoints': eps
     })
 
 
+@require_manager_password
+def endpoint_status(request):
+    """
+    JSON status API: stored health of every endpoint.
+    """
+    health.ensure_monitor()
+    return JsonResponse({
+        'endpoints': [health.status(ep) for ep in Endpoint.objects.select_related('health')]
+    })
+
+
 @require_manager_password
 @require_http_methods(["GET", "POST"])
 def endpoint_add(request):
@@ -132,9 +117,16 @@ def endpoint_add(request):
 @require_http_methods(["GET", "POST"])
 def endpoint_edit(request, pk):
     ep   = get_object_or_404(Endpoint, pk=pk)
+    old_url = ep.url
     form = EndpointForm(request.POST or None, request.FILES or None, instance=ep)
     if form.is_valid():
         form.save()
+        # the URL may have changed: rebuild its connection pool on next use
+        # and forget whatever it answered before
+        reset_session(old_url, ep.url)
+        result_cache.invalidate(ep.pk)
+        frame_cache.invalidate()
+        breaker.reset(ep.pk)
         messages.success(request, "Endpoint updated!")
         return redirect('endpoint_manager')
 
@@ -144,6 +136,18 @@ def endpoint_edit(request, pk):
     })
 
 
+@require_manager_password
+@require_POST
+def cache_clear(request):
+    """
+    Drop every cached federated answer, e.g. after the nodes reloaded their data.
+    """
+    result_cache.invalidate()
+    frame_cache.invalidate()
+    messages.success(request, "Result cache cleared!")
+    return redirect('endpoint_manager')
+
+
 @require_manager_password
 @require_http_methods(["GET", "POST"])
 def endpoint_delete(request, pk):
@@ -152,7 +156,11 @@ def endpoint_delete(request, pk):
         # remove the file from storage first
         if ep.logo:
             ep.logo.delete(save=False)
-        # then delete the DB record
+        # then delete the DB record and its pooled connections
+        reset_session(ep.url)
+        result_cache.invalidate(ep.pk)
+        frame_cache.invalidate()
+        breaker.reset(ep.pk)
         ep.delete()
         messages.success(request, "Endpoint deleted!")
         return redirect('endpoint_manager')
@@ -171,12 +179,12 @@ def home(request):
 
 @login_required
 def central_catalog(request):
-    entries = catalog()
-    for idx, e in enumerate(entries):
-        e["id"] = idx
+    entries = [{**e, 'rewritable': bool(rewrite.rewrite_avg(e['template'])[1])}
+               for e in catalog()]
 
     return render(request, "catalogapp/catalog.html", {
         "catalog": entries,
+        "rewrite_default": getattr(settings, 'FEDERATION_REWRITE_AVG', False),
         "QUESTION_CHOICES": QUESTION_CHOICES,
         # add this line:
         "QUESTION_CHOICES_JSON": json.dumps(QUESTION_CHOICES),
@@ -193,9 +201,7 @@ def query_view(request):
     # 1) Grab the id param (must be present on both GET and POST)
     raw_id = request.GET.get('id') if request.method == 'GET' else request.POST.get('id')
     try:
-        idx     = int(raw_id)
-        entries = catalog()
-        entry   = entries[idx]
+        entry = by_id(raw_id)
     except Exception:
         messages.error(request, "Unknown query template.")
         return redirect('central_catalog')
@@ -205,85 +211,84 @@ def query_view(request):
         # <-- only pass params now, not template
         form = QueryForm(request.POST, params=entry['params'])
         if form.is_valid():
+            # AVG projections may be dispatched as SUM/COUNT pairs, so the
+            # endpoints' answers merge into exact global means
+            template, avgs = _rewrite_avg(entry, request.POST)
+            params = {**form.cleaned_data, 'rewrite': 'avg'} if avgs else form.cleaned_data
+
             # build the concrete SPARQL
-            q = entry['template']
-            for k, v in form.cleaned_data.items():
-                q = q.replace(f'{{{k}}}', v)
-
-
-            q = prefixes + q
-
-            # Mask out the original template markers so they don’t get sent along
-            entry['template'] = entry['template'].replace('<{', '**<').replace('}>', '>**')
-            results = []
-
-            for ep in Endpoint.objects.all():
-                url = ep.url.rstrip('/') + '/sparql-protected/'
-
-                try:
-                    resp = requests.post(
-                        url,
-                        data=urllib.parse.urlencode({
-                            'template': entry['template'],
-                            'query':    q,
-                        }, quote_via=urllib.parse.quote, safe=''),
-                        headers={
-                            'Accept': 'application/sparql-results+json',
-                            'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'
-                        },
-                        timeout=5
-                    )
-                    # Raise an exception if status is 4xx/5xx
-                    resp.raise_for_status()
-
-                    data = resp.json()
-
-                    # Handle ASK, SELECT, or empty/unauthorized cases
-                    if 'boolean' in data:
-                        results.append({
-                            'endpoint': ep.name,
-                            'logo_url': ep.logo.url,
-                            'boolean':  data['boolean']
-                        })
-
-                    elif 'head' in data and 'results' in data:
-                        head = data['head']['vars']
-                        for bd in data['results']['bindings']:
-                            row = {}
-                            for v in head:
-                                # only pull bd[v]['value'] if it exists
-                                if v in bd:
-                                    row[v] = bd[v]['value']
-                                else:
-                                    row[v] = None
-                            row['endpoint'] = ep.name
-                            row['logo_url']  = ep.logo.url
-                            results.append(row)
-
-                    elif 'results' in data:
-                        # Known template but no results (or unauthorized)
-                        results.append({
-                            'endpoint': ep.name,
-                            'logo_url': ep.logo.url,
-                            'rows':     []
-                        })
-
-                    else:
-                        # Unexpected JSON shape
-                        results.append({
-                            'endpoint': ep.name,
-                            'logo_url': ep.logo.url,
-                            'error':    'Invalid response'
-                        })
-
-                except requests.RequestException:
-                    # If anything goes wrong (timeout, HTTP error, connection error),
-                    # just skip this endpoint.
-                    continue
-            return render(request, 'catalogapp/results.html', {
-                'query':   q,
-                'results': results
-            })
+            q = _instantiate(template, form.cleaned_data)
+
+            # the same result set as a download (export_results)
+            export_query = urlencode({'id': entry['id'], **form.cleaned_data,
+                                      'rewrite_avg': '1' if avgs else '0'})
+
+            # Streaming mode: push each endpoint's rows as soon as it answers
+            if request.POST.get('stream'):
+                return _stream_results(entry, params, q, template, avgs, request.session, export_query)
+
+            booleans = []
+            parts    = []
+            failed   = []
+            transferred = 0
+
+            # the same data fetched moments ago (by anyone, or for training)
+            endpoints = list(Endpoint.objects.all())
+            with _frame_flight(entry, params, endpoints, request.session) as (key, merged):
+                if merged is not None:
+                    logos = {ep.name: ep.logo.url for ep in endpoints}
+                    merged['logo_url'] = merged['endpoint'].map(logos)
+                    endpoints = []
+
+                for res in fan_out(endpoints, template, q,
+                                   entry=entry, params=params):
+                    # If anything went wrong (timeout, HTTP error, connection error,
+                    # endpoint known to be down), just list it as failed.
+                    if not res.ok:
+                        failed.append(res.failure)
+                        continue
+                    kind, value = _endpoint_answer(res.data)
+                    ep = res.endpoint
+                    if kind == 'boolean':
+                        booleans.append({'endpoint': ep.name, 'logo_url': ep.logo.url, 'boolean': value})
+                    elif kind == 'select':
+                        transferred += len(value)
+                        parts.append((ep.name, ep.logo.url, rewrite.node_means(value, avgs) if avgs else value))
+                    elif kind == 'invalid':
+                        failed.append(f"{ep.name} – invalid response")
+
+                cached = merged is not None
+                result_id = key if cached else None
+                if not cached:
+                    merged = columnar.merge(parts)
+                    # the result set is paged from the frame cache; complete
+                    # fan-outs are also reused by later requests, others only paged
+                    result_id = key if parts and not failed else uuid.uuid4().hex
+                    if booleans or not _cache_frame(result_id, merged.drop(columns='logo_url'),
+                                                    request.session):
+                        result_id = None
+            columns = [c for c in merged.columns if c not in ('endpoint', 'logo_url')]
+            page_size = getattr(settings, 'RESULTS_PAGE_SIZE', 100)
+            context = {
+                'query':    q,
+                'booleans': booleans,
+                'columns':  columns,
+                'total':    len(merged),
+                'failed':   failed,
+                'rows_transferred': transferred,
+                'cached':   cached,
+                'export_query': export_query,
+            }
+            if result_id:
+                context.update(page_url=reverse('result_page', args=[result_id]), page_size=page_size)
+            else:
+                # no stored result set (frame cache disabled): only the first page
+                context['rows'] = columnar.rows(merged.head(page_size), ['logo_url', 'endpoint'] + columns)
+            if avgs:
+                overall = rewrite.global_means(merged, avgs)
+                context.update(global_columns=list(overall.columns),
+                               global_rows=columnar.rows(overall, list(overall.columns)))
+            return render(request, 'catalogapp/results.html', context)
 
     # 3) Otherwise (GET) just show the form
     else:
@@ -296,277 +301,383 @@ def query_view(request):
         'template':    entry['template'],
         'form':        form,
         'id':          raw_id,
+        'rewritable':  bool(rewrite.rewrite_avg(entry['template'])[1]),
+        'rewrite_default': getattr(settings, 'FEDERATION_REWRITE_AVG', False),
     })
+
+
+def _instantiate(template, values):
+    """The concrete SPARQL of `template` with its form `values` filled in."""
+    q = template
+    for k, v in values.items():
+        q = q.replace(f'{{{k}}}', v)
+    return prefixes + q
+
+
+def _endpoint_answer(data):
+    """
+    Classify one endpoint's JSON answer as
+      ('boolean', value) – ASK
+      ('select', frame)  – SELECT bindings, as a DataFrame
+      ('empty', None)    – known template but no results (or unauthorized)
+      ('invalid', None)  – unexpected JSON shape
+    """
+    if 'boolean' in data:
+        return 'boolean', data['boolean']
+    elif 'head' in data and 'results' in data:
+        return 'select', columnar.frame_from_sparql(data)
+    elif 'results' in data:
+        return 'empty', None
+    return 'invalid', None
+
+
+def _rewrite_avg(entry, data):
+    """
+    (template to dispatch, AVG variables rewritten into SUM/COUNT pairs).
+    `rewrite_avg` in the request ('1'/'0') overrides FEDERATION_REWRITE_AVG.
+    """
+    flag = data.get('rewrite_avg')
+    if flag in (None, ''):
+        enabled = getattr(settings, 'FEDERATION_REWRITE_AVG', False)
+    else:
+        enabled = flag in ('1', 'on', 'true')
+    if not enabled:
+        return entry['template'], []
+    return rewrite.rewrite_avg(entry['template'])
+
+
+def _cached_frame(entry, params, endpoints, session=None, pinned=False):
+    """
+    (key, merged frame) of an earlier complete fan-out of `entry` with
+    `params` to `endpoints`, from the frame cache. The frame is None on a
+    miss, the key None when the cache is disabled.
+    """
+    cache = frame_cache.get_frame_cache()
+    if cache is None:
+        return None, None
+    key = frame_cache.frame_key(entry, params, endpoints)
+    frame = cache.get(key, pinned=pinned or frame_cache.pinned(session, key))
+    if frame is not None:
+        frame_cache.remember(session, key)
+    return key, frame
+
+
+@contextmanager
+def _frame_flight(entry, params, endpoints, session=None, pinned=False, enabled=True):
+    """
+    (key, frame) as _cached_frame. On a miss the block fetches the frame
+    (and calls _cache_frame) holding the key's lock across worker processes
+    (frame_cache.flight), so identical fan-outs elsewhere wait and read it.
+    """
+    key, frame = _cached_frame(entry, params, endpoints, session, pinned) if enabled else (None, None)
+    if frame is not None:
+        yield key, frame
+        return
+    with frame_cache.flight(key) as locked:
+        if locked:
+            # another worker may have fetched it while we waited
+            frame = _cached_frame(entry, params, endpoints, session, pinned)[1]
+        yield key, frame
+
+
+def _cache_frame(key, frame, session=None):
+    """
+    Save the merged frame of a complete fan-out (every endpoint answered),
+    or any result set to page through; True if it was stored.
+    """
+    cache = frame_cache.get_frame_cache()
+    if key is not None and cache is not None and cache.put(key, frame):
+        frame_cache.remember(session, key)
+        return True
+    return False
+
+
+def _stream_results(entry, params, q, template, avgs, session, export_query):
+    """
+    NDJSON response for the streaming mode of query_view: one line per
+    endpoint, in the order they answer, then a summary and a final {"done": true}.
+      {"endpoint": …, "logo_url": …, "boolean": true|false}
+      {"endpoint": …, "logo_url": …, "columns": [var, …], "rows": [[value, …], …], "count": n}
+      {"endpoint": …, "error": …, "failed": …}
+      {"rows_transferred": n, "total": n, "columns": […], "page_url": …, "page_size": n,
+       "export_url": …, "global": {"columns": […], "rows": […]}}
+    Only the first RESULTS_PAGE_SIZE rows overall are sent in the endpoint
+    lines (`count` is the endpoint's full number of rows); the whole result
+    set is stored in the frame cache, to be paged from `page_url` (absent
+    when the cache is off, or for ASK answers). `global`: AVG rewrite only.
+    """
+    endpoints = list(Endpoint.objects.all())
+    page_size = getattr(settings, 'RESULTS_PAGE_SIZE', 100)
+    # the session is saved before the response is streamed: pin both ids
+    # the result set may be stored under (complete fan-out or not) now
+    key, partial_id = None, None
+    if frame_cache.get_frame_cache() is not None:
+        key, partial_id = frame_cache.frame_key(entry, params, endpoints), uuid.uuid4().hex
+        frame_cache.remember(session, key)
+        frame_cache.remember(session, partial_id)
+
+    def lines():
+        parts, failed, booleans = [], False, False
+        transferred, budget = 0, page_size
+        for res in iter_fan_out(endpoints, template, q, entry=entry, params=params):
+            ep = res.endpoint
+            line = {'endpoint': ep.name}
+            kind, value = _endpoint_answer(res.data) if res.ok else ('failed', None)
+            if kind == 'boolean':
+                booleans = True
+                line.update(logo_url=ep.logo.url, boolean=value)
+            elif kind == 'select':
+                transferred += len(value)
+                if avgs:
+                    value = rewrite.node_means(value, avgs)
+                parts.append((ep.name, ep.logo.url, value))
+                columns = list(value.columns)
+                line.update(logo_url=ep.logo.url, columns=columns, count=len(value),
+                            rows=columnar.rows(value.head(budget), columns))
+                budget -= len(line['rows'])
+            elif kind == 'empty':
+                line.update(logo_url=ep.logo.url, columns=[], rows=[], count=0)
+            elif kind == 'invalid':
+                failed = True
+                line.update(error='Invalid response', failed=f"{ep.name} – invalid response")
+            else:
+                failed = True
+                line.update(error=str(res.error), failed=res.failure)
+            yield json.dumps(line) + '\n'
+
+        merged = columnar.merge(parts)
+        summary = {
+            'rows_transferred': transferred,
+            'total':      len(merged),
+            'columns':    [c for c in merged.columns if c not in ('endpoint', 'logo_url')],
+            'export_url': f"{reverse('export_results')}?{export_query}",
+        }
+        # complete fan-outs are also reused by later requests, others only paged
+        result_id = key if parts and not failed else partial_id
+        if not booleans and _cache_frame(result_id, merged.drop(columns='logo_url', errors='ignore')):
+            summary.update(page_url=reverse('result_page', args=[result_id]), page_size=page_size)
+        if avgs:
+            overall = rewrite.global_means(merged, avgs)
+            summary['global'] = {'columns': list(overall.columns),
+                                 'rows': columnar.rows(overall, list(overall.columns))}
+        yield json.dumps(summary) + '\n'
+        yield json.dumps({'done': True}) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    # ask proxies (nginx) not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
     
 
         
 @login_required
 def run_analytics(request):
+    """
+    Fan the catalog query tagged `query_key` out to all endpoints and merge
+    the answers with the operator registered for that key (catalogapp.analytics):
+    { results: […], responders: […], failed: […] }.
+    """
     key = request.POST.get('query_key')
-    entries = catalog()
-    entry = next((e for e in entries if e.get('analytics_key') == key), None)
-    if not entry:
+    entry = by_analytics_key(key)
+    op = analytics.get(key)
+    if not entry or not op:
         return JsonResponse({'results': [], 'responders': [], 'failed': []})
 
     # 1) Build SPARQL string
     q = prefixes + entry['template']
+    params = {}
     for param in entry['params']:
         v = request.POST.get(param) or ''
         q = q.replace(f'{{{param}}}', v)
-    masked_template = entry['template'].replace('<{', '**<').replace('}>', '>**')
-
-    # 2) If KL-divergence, delegate to each endpoint
-    if key == 'klDiv':
-        results = []
-        responders = []
-        failed = []
-        for ep in Endpoint.objects.all():
-            url = ep.url.rstrip('/') + '/sparql-protected/'
-            try:
-                resp = requests.post(
-                    url,
-                    data=urllib.parse.urlencode({
-                        'template':     masked_template,
-                        'query':        q,
-                        'analytics_key': key,
-                    }, quote_via=urllib.parse.quote, safe=''),
-                    headers={
-                        'Accept': 'application/json',
-                        'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'
-                    },
-                    timeout=5
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                results.append({'endpoint': ep.name, 'kl_divergence': data.get('kl_divergence')})
-                responders.append({'name': ep.name, 'logo_url': ep.logo.url})
-            except Exception:
-                failed.append(ep.name)
-        return JsonResponse({'results': results, 'responders': responders, 'failed': failed})
-
-    # 3) Fallback: ageDist local aggregation
-    raw_bindings = []
-    responders = []
-    failed = []
-    for ep in Endpoint.objects.all():
-        url = ep.url.rstrip('/') + '/sparql-protected/'
-        try:
-            resp = requests.post(
-                url,
-                data=urllib.parse.urlencode({
-                    'template': masked_template,
-                    'query':    q,
-                }, quote_via=urllib.parse.quote, safe=''),
-                headers={
-                    'Accept': 'application/sparql-results+json',
-                    'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'
-                },
-                timeout=5
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            bds = data.get('results', {}).get('bindings', []) or data.get('results') if isinstance(data.get('results'), list) else []
-            for bd in bds:
-                def norm(k):
-                    v = bd.get(k)
-                    return (isinstance(v, dict) and v.get('value')) or v
-                raw_bindings.append({
-                    'bracket':  norm('bracket'),
-                    'n':        norm('n')
-                })
-            responders.append({'name': ep.name, 'logo_url': ep.logo.url})
-        except Exception:
-            failed.append(ep.name)
-    agg = {}
-    for r in raw_bindings:
-        b = r.get('bracket')
-        c = int(r.get('n') or 0)
-        agg[b] = agg.get(b, 0) + c
-    results = [{'bracket': label, 'n': agg[label]} for label in sorted(agg.keys(), key=lambda s: int(''.join(filter(str.isdigit, s)) or 0))]
-    return JsonResponse({'results': results, 'responders': responders, 'failed': failed})
-
-    """
-    Run the same fan-out SPARQL logic as in query_view, but return
-    either:
-      • { results: [ {bucket,n}, … ], responders: […], failed: […] }
-        for ageDist
-      • { distribution_true: […], distribution_false: […],
-          kl_divergence: float, responders: […], failed: […] }
-        for klDiv
-    """
-    key = request.POST.get('query_key')
-    entries = catalog()
-    entry = next((e for e in entries if e.get('analytics_key') == key), None)
-    if not entry:
-        return JsonResponse({"results": [], "responders": [], "failed": []})
+        params[param] = v
+
+    # 2) Fan out; delegated analytics are computed by the nodes themselves.
+    #    Plain SPARQL answers may already be in the frame cache (sketches
+    #    built while parsing are not)
+    extra = {'analytics_key': key} if op.delegate else {}
+    endpoints = list(Endpoint.objects.all())
+    with _frame_flight(entry, {**params, **extra}, endpoints, request.session,
+                       enabled=not op.parse) as (cache_key, merged):
+        if merged is not None:
+            return JsonResponse({
+                **op.merge(merged),
+                'responders': [{'name': ep.name, 'logo_url': ep.logo.url} for ep in endpoints],
+                'failed': [],
+            })
+        parts, responders, failed = _analytics_answers(op, endpoints, entry, q, params, extra)
 
-    # 1) Build SPARQL string
-    q = prefixes + entry['template']
-    for param in entry['params']:
-        v = request.POST.get(param) or ''
-        q = q.replace(f'{{{param}}}', v)
+        # 3) One vectorized merge over all the answers
+        merged = columnar.merge(parts).drop(columns='logo_url', errors='ignore')
+        if parts and not failed:
+            _cache_frame(cache_key, merged, request.session)
+    return JsonResponse({**op.merge(merged), 'responders': responders, 'failed': failed})
 
-    entry['template'] = entry['template'].replace('<{', '**<').replace('}>', '>**')
 
-    # 2) Fan-out to endpoints, collect raw bindings
-    raw_bindings = []
+def _analytics_answers(op, endpoints, entry, q, params, extra):
+    """(parts for columnar.merge, responders, failed) of an analytics fan-out."""
+    parts = []
     responders = []
     failed = []
-
-    for ep in Endpoint.objects.all():
-        url = ep.url.rstrip('/') + '/sparql-protected/'
+    # delegated answers are plain JSON objects, never parsed as SPARQL
+    parse = None if op.delegate else op.parse
+    for res in fan_out(endpoints, entry['template'], q,
+                       accept=op.accept, entry=entry, params=params, parse=parse, **extra):
+        ep = res.endpoint
+        if not res.ok:
+            failed.append(res.failure)
+            continue
         try:
-            resp = requests.post(
-                url,
-                data=urllib.parse.urlencode({
-                    'template': entry['template'],
-                    'query':    q,
-                }, quote_via=urllib.parse.quote, safe=''),
-                headers={
-                    'Accept': 'application/sparql-results+json',
-                    'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'
-                },
-                timeout=5
-            )
-            resp.raise_for_status()
-            data = resp.json()
-
-            # Extract SPARQL bindings
-            if isinstance(data.get('results'), list):
-                bds = data['results']
-            elif data.get('results', {}).get('bindings'):
-                bds = data['results']['bindings']
+            if op.delegate:
+                frame = pd.DataFrame([res.data])
+            elif parse:
+                frame = res.data
             else:
-                bds = []
-
-            # Normalize and collect
-            for bd in bds:
-                def norm(k):
-                    v = bd.get(k)
-                    return (isinstance(v, dict) and v.get('value')) or v
-                raw_bindings.append({
-                    'b':        norm('b'),
-                    'ageOn':    norm('ageOn'),
-                    'bracket':  norm('bracket'),
-                    'n':        norm('n'),
-                    'endpoint': ep.name,
-                    'logo_url': ep.logo.url,
-                })
+                frame = columnar.frame_from_sparql(res.data)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # a malformed answer only costs that endpoint
+            failed.append(ep.name)
+            continue
+        parts.append((ep.name, None, frame))
+        responders.append({'name': ep.name, 'logo_url': ep.logo.url})
+    return parts, responders, failed
 
-            responders.append({
-                'name':     ep.name,
-                'logo_url': ep.logo.url
-            })
+
+@login_required
+def result_page(request, result_id):
+    """
+    One page of a query_view result set, for the virtual-scrolling table:
+    ?offset=&limit=&sort=<column>&desc=1 →
+    {total, offset, columns, rows: [[endpoint, value, …], …], logos: {endpoint: url}}.
+    Only the session that ran the query may read it.
+    """
+    cache = frame_cache.get_frame_cache()
+    if cache is None or not frame_cache.pinned(request.session, result_id):
+        return JsonResponse({'error': 'Unknown or expired result set'}, status=404)
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        limit  = int(request.GET.get('limit', getattr(settings, 'RESULTS_PAGE_SIZE', 100)))
+        limit  = min(max(limit, 1), getattr(settings, 'RESULTS_PAGE_MAX', 1000))
+        total, page = cache.page(result_id, offset, limit, request.GET.get('sort') or None,
+                                 request.GET.get('desc') in ('1', 'true'))
+    except KeyError:
+        return JsonResponse({'error': 'Unknown or expired result set'}, status=404)
+    except ValueError as ex:
+        return JsonResponse({'error': str(ex)}, status=400)
+
+    columns = [c for c in page.columns if c not in ('endpoint', 'logo_url')]
+    names = set(page['endpoint'].astype(str)) if 'endpoint' in page.columns else set()
+    return JsonResponse({
+        'total':   total,
+        'offset':  offset,
+        'columns': columns,
+        'rows':    columnar.rows(page, ['endpoint'] + columns),
+        'logos':   {ep.name: ep.logo.url for ep in Endpoint.objects.filter(name__in=names)},
+    })
 
 
-        except Exception:
-            failed.append(ep.name)
-            continue
+@login_required
+@require_http_methods(["GET", "POST"])
+def export_results(request):
+    """
+    Download a query_view result set (same `id` and template fields, plus
+    `format`: csv, ndjson or parquet), streamed as the endpoints answer: one
+    row per endpoint row, its `endpoint` first. A result set in the frame
+    cache is streamed from there instead.
+    """
+    data = request.POST if request.method == 'POST' else request.GET
+    fmt = data.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return JsonResponse({'error': f"Unknown format {fmt!r}"}, status=400)
+    try:
+        entry = by_id(data.get('id'))
+    except Exception:
+        return JsonResponse({'error': 'Unknown query template'}, status=404)
+    form = QueryForm(data, params=entry['params'])
+    if not form.is_valid():
+        return JsonResponse({'error': form.errors}, status=400)
+
+    template, avgs = _rewrite_avg(entry, data)
+    params = {**form.cleaned_data, 'rewrite': 'avg'} if avgs else form.cleaned_data
+    endpoints = list(Endpoint.objects.all())
+    chunk_rows = getattr(settings, 'EXPORT_CHUNK_ROWS', 10000)
+
+    cache = frame_cache.get_frame_cache()
+    cached = None
+    if cache is not None:
+        key = frame_cache.frame_key(entry, params, endpoints)
+        cached = cache.batches(key, chunk_rows, pinned=frame_cache.pinned(request.session, key))
+    if cached is not None:
+        chunks = export.frame_chunks(cached)
+    else:
+        # straight from the endpoints, bypassing the result cache and warehouse
+        chunks = export.fan_out_chunks(
+            endpoints, template, _instantiate(template, form.cleaned_data),
+            chunk_rows=chunk_rows,
+            queue_size=getattr(settings, 'EXPORT_QUEUE_CHUNKS', 4),
+            transform=partial(rewrite.node_means, avgs=avgs) if avgs else None,
+        )
 
-    # 3) Branch on analytics key
-    if key == 'klDiv':
-        # Split ages by bulbar flag
-        #ages_true  = [int(r['ageOn']) for r in raw_bindings if str(r['b']).lower() == 'true']
-        #ages_false = [int(r['ageOn']) for r in raw_bindings if str(r['b']).lower() == 'false']
-        
-        # Split ages by bulbar flag, parsing as float
-        if key == 'klDiv':
-            ages_true, ages_false = [], []
-            for r in raw_bindings:
-                try:
-                    age = float(r['ageOn'])
-                except (TypeError, ValueError):
-                    continue
-                if str(r['b']).lower() == 'true':
-                    ages_true.append(age)
-                else:
-                    ages_false.append(age)
-
-
-        all_ages = ages_true + ages_false
-        if not all_ages:
-            return JsonResponse({
-                "distribution_true": [],
-                "distribution_false": [],
-                "kl_divergence":     None,
-                "responders":        responders,
-                "failed":            failed
-            })
+    content_type, extension = export.FORMATS[fmt]
+    response = StreamingHttpResponse(export.WRITERS[fmt](chunks), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="query-{entry["id"]}.{extension}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
-        # Shared bin edges
-        bins = np.linspace(min(all_ages), max(all_ages), num=11)
-        p_counts, _     = np.histogram(ages_true,  bins=bins)
-        q_counts, edges = np.histogram(ages_false, bins=bins)
-
-        # Convert to PMFs with smoothing
-        eps = 1e-9
-        total = (p_counts + q_counts + 2*eps).sum()
-        p = (p_counts + eps) / total
-        q = (q_counts + eps) / total
-
-        # Compute KL divergence D(P‖Q)
-        kl = float((p * np.log(p / q)).sum())
-
-        # Build JSON-safe distributions
-        dist_true = [
-            {"range": f"{edges[i]:.0f}–{edges[i+1]:.0f}", "p": float(p[i])}
-            for i in range(len(p))
-        ]
-        dist_false = [
-            {"range": f"{edges[i]:.0f}–{edges[i+1]:.0f}", "p": float(q[i])}
-            for i in range(len(q))
-        ]
-
-        return JsonResponse({
-            "distribution_true":  dist_true,
-            "distribution_false": dist_false,
-            "kl_divergence":      kl,
-            "responders":         responders,
-            "failed":             failed
-        })
 
-    # Fallback: ageDist (merge brackets → counts)
-    agg = {}
-    for r in raw_bindings:
-        b = r.get('bracket')
-        c = int(r.get('n') or 0)
-        agg[b] = agg.get(b, 0) + c
-
-    # **Return bracket & n** so the existing JS still works
-    results = [
-        {"bracket": label, "n": agg[label]}
-        for label in sorted(
-            agg.keys(),
-            key=lambda s: int(''.join(filter(str.isdigit, s)) or 0)
+@login_required
+@require_http_methods(["GET", "POST"])
+def warehouse_sql(request):
+    """
+    Ad-hoc SQL over the history of federated answers (catalogapp.warehouse):
+    GET shows the tables and a query box, POST `sql` (one SELECT) returns
+    {columns, rows, truncated}.
+    """
+    store = warehouse.get_warehouse()
+    if request.method == 'GET':
+        try:
+            tables = store.tables() if store is not None else {}
+        except warehouse.WarehouseBusy:
+            tables = {}
+        return render(request, 'catalogapp/warehouse.html', {
+            'available': store is not None,
+            'tables':    tables,
+        })
+    if store is None:
+        return JsonResponse({'error': 'The warehouse is disabled'}, status=503)
+    try:
+        columns, rows, truncated = store.query(
+            request.POST.get('sql', ''),
+            max_rows=getattr(settings, 'WAREHOUSE_MAX_ROWS', 10000),
+            timeout=getattr(settings, 'WAREHOUSE_QUERY_TIMEOUT', 30),
         )
-    ]
+    except ValueError as ex:
+        return JsonResponse({'error': str(ex)}, status=400)
+    except warehouse.WarehouseBusy:
+        return JsonResponse({'error': 'The warehouse is busy, try again'}, status=503)
+    return JsonResponse({'columns': columns, 'rows': rows, 'truncated': truncated})
+
 
-    return JsonResponse({
-        "results":    results,
-        "responders": responders,
-        "failed":     failed
-    })
-    
 @require_POST
 @login_required
 def train_model(request):
-    # 1) Re-run the underlying query to get {evType, sex, endpoint, ageOn}
+    """
+    Queue a regression-tree training job over the federated data of
+    query `id` for `disease` (or, with `aggregate`, over per-node group
+    statistics); poll training_job for its progress and results.
+    """
     disease = request.POST.get("disease")
     if not disease:
         return JsonResponse({"error": "Missing disease parameter"}, status=400)
-
-    df = _fetch_query_dataframe(request.POST['id'], disease)
-    # catalogapp/views.py, in train_model, after you have your df:
-    if 'aOns' in df.columns and 'ageOn' not in df.columns:
-        df = df.rename(columns={'aOns':'ageOn'})
-        
-    print(df.head())
-
-    # 2) one-hot encode categorical cols
-    X = pd.get_dummies(df[['evType','sex','endpoint']], drop_first=True)
-    y = df['ageOn'].astype(float)
-
-    # 3) collect params
+    try:
+        query_id = by_id(request.POST.get('id'))['id']
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({"error": "Unknown query template"}, status=400)
+    # node-side aggregation: fetch per-group count/sum/sum of squares of the
+    # onset age instead of the patient rows (O(groups) instead of O(patients))
+    if request.POST.get('aggregate'):
+        query_id = by_analytics_key('ageOnStats')['id']
+
+    # collect params
     params = {}
     for p in TREE_PARAMS:
         v = request.POST.get(p)
@@ -575,47 +686,103 @@ def train_model(request):
             # numeric params come in as strings of digits
             params[p] = int(v) if v.isdigit() else v
 
-    # 4) train/test split
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.3, random_state=params.get('random_state',42)
-    )
+    # hyperparameter search: each param is a comma-separated list of values
+    search = None
+    mode = request.POST.get('search', '')
+    if mode:
+        try:
+            search = _search_spec(request.POST, mode)
+        except ValueError as ex:
+            return JsonResponse({"error": str(ex)}, status=400)
+        params = {}
+
+    # on groups only some criteria fit the tree the patient rows would give
+    if request.POST.get('aggregate'):
+        criteria = search['grid'].get('criterion', []) if search else [params.get('criterion')]
+        wrong = [c for c in criteria if c not in (None,) + training.GROUP_CRITERIA]
+        if wrong:
+            return JsonResponse({"error": f"criterion {wrong[0]!r} can't be used with aggregate, "
+                                          f"use one of {', '.join(training.GROUP_CRITERIA)}"}, status=400)
+
+    # retraining reuses the data this session already fetched (frame cache)
+    key = frame_cache.frame_key(by_id(query_id), {"disease": disease}, Endpoint.objects.all())
+    fetch = partial(_fetch_query_dataframe, pinned=frame_cache.pinned(request.session, key))
+    frame_cache.remember(request.session, key)
+
+    job = jobs.submit(query_id, disease, params, fetch=fetch, search=search)
+    return JsonResponse({
+        **jobs.status(job),
+        'status_url': reverse('training_job', args=[job.pk]),
+    }, status=202)
 
-    model = DecisionTreeRegressor(**params)
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
 
-    # 5) metrics
-    metrics = {
-        'MSE': mean_squared_error(y_test, y_pred),
-        'R^2': r2_score(y_test, y_pred),
-        # you can add cross-val etc.
-    }
+def _search_spec(data, mode):
+    """The job.search dict of a train_model request; ValueError if invalid."""
+    if mode not in ('grid', 'random'):
+        raise ValueError(f"Unknown search mode {mode!r}")
+    grid = {}
+    for p in TREE_PARAMS:
+        values = [v.strip() for v in data.get(p, '').split(',') if v.strip()]
+        if values:
+            grid[p] = [int(v) if v.isdigit() else v for v in values]
+    folds  = int(data.get('cv') or 5)
+    n_iter = int(data.get('n_iter') or 10)
+    if not 2 <= folds <= 20:
+        raise ValueError("cv must be between 2 and 20 folds")
+    if n_iter < 1:
+        raise ValueError("n_iter must be positive")
+
+    n = len(training.candidates(grid, mode, n_iter))
+    limit = getattr(settings, 'TRAINING_SEARCH_MAX_CANDIDATES', 200)
+    if n > limit:
+        raise ValueError(f"{n} candidates, at most {limit} allowed")
+    return {'mode': mode, 'grid': grid, 'folds': folds, 'n_iter': n_iter}
 
-    # 6) render tree to PNG
-    buf = io.BytesIO()
-    fig, ax = plt.subplots(figsize=(10,6))
-    plot_tree(model, feature_names=X.columns, filled=True, ax=ax)
-    fig.tight_layout()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    tree_png = base64.b64encode(buf.read()).decode('ascii')
-    plt.close(fig)
 
-    # 7) stash model and return JSON
-    model_id = str(uuid.uuid4())
-    _models[model_id] = (model, X.columns)  # save feature order
+@login_required
+def training_job(request, job_id):
+    """
+    Status of a training job; once done it carries metrics, model_id and
+    the URLs of the tree (JSON, PNG and SVG).
+    """
+    job = get_object_or_404(TrainingJob, pk=job_id)
+    out = jobs.status(job)
+    if job.status == TrainingJob.DONE:
+        out['tree_url'] = reverse('model_tree', args=[job.pk])
+        out['tree_images'] = {fmt: reverse('model_tree_image', args=[job.pk, fmt])
+                              for fmt in jobs.TREE_IMAGE_TYPES}
+    return JsonResponse(out)
+
+
+@login_required
+def model_tree(request, model_id):
+    """The fitted tree of a model as nested JSON nodes, built on first request."""
+    try:
+        data = jobs.tree_json(model_id)
+    except KeyError:
+        return JsonResponse({'error': 'Unknown model'}, status=404)
+    return HttpResponse(data, content_type='application/json')
+
+
+@login_required
+def model_tree_image(request, model_id, fmt):
+    """The fitted tree of a model drawn as PNG or SVG, rendered on first request."""
+    if fmt not in jobs.TREE_IMAGE_TYPES:
+        return JsonResponse({'error': f'Unsupported format {fmt!r}'}, status=404)
+    try:
+        data = jobs.tree_image(model_id, fmt)
+    except KeyError:
+        return JsonResponse({'error': 'Unknown model'}, status=404)
+    return HttpResponse(data, content_type=jobs.TREE_IMAGE_TYPES[fmt])
 
-    return JsonResponse({
-        'metrics': metrics,
-        'tree_png': tree_png,
-        'model_id': model_id
-    })
 
 @require_POST
 @login_required
 def predict_model(request):
-    model_id = request.POST['model_id']
-    model, cols = _models[model_id]
+    try:
+        model = jobs.load_model(_model_id(request.POST.get('model_id')))
+    except KeyError:
+        return JsonResponse({'error': 'Unknown model'}, status=404)
 
     # build a one‐row DataFrame
     sample = {
@@ -623,25 +790,88 @@ def predict_model(request):
       'sex':     request.POST['sex'],
       'endpoint':request.POST['endpoint'],
     }
-    df = pd.get_dummies(pd.DataFrame([sample]))
-    # ensure all columns
-    for c in cols:
-        if c not in df: df[c] = 0
-    df = df[cols]
-
-    pred = model.predict(df)[0]
+    pred = training.predict(model, pd.DataFrame([sample]))[0]
     return JsonResponse({'predicted': float(pred)}) 
 
 
-def _fetch_query_dataframe(query_id, disease):
+@require_POST
+@login_required
+def predict_batch(request):
+    """
+    Score many samples with one encoder pass and one model.predict call.
+
+    Body is either JSON {"model_id": …, "samples": [{"evType", "sex", "endpoint"}, …]}
+    or CSV (Content-Type: text/csv) with those three columns, the model then
+    given as ?model_id=…. Returns {"model_id", "predictions": [...]} in sample order.
+    """
+    try:
+        if request.content_type == 'text/csv':
+            model_id = request.GET.get('model_id', '')
+            samples = pd.read_csv(io.BytesIO(request.body), dtype=str, keep_default_na=False)
+        else:
+            payload = json.loads(request.body)
+            model_id = payload.get('model_id', '')
+            samples = pd.DataFrame.from_records(payload.get('samples', []))
+    except (ValueError, AttributeError, pd.errors.ParserError) as ex:
+        return JsonResponse({'error': f'Malformed samples: {ex}'}, status=400)
+
+    missing = [c for c in training.FEATURES if c not in samples.columns]
+    if missing:
+        return JsonResponse({'error': f'Missing columns: {", ".join(missing)}'}, status=400)
+    limit = getattr(settings, 'PREDICT_BATCH_MAX_ROWS', 100000)
+    if len(samples) > limit:
+        return JsonResponse({'error': f'At most {limit} samples per request'}, status=400)
+
+    try:
+        model_id = _model_id(model_id)
+        model = jobs.load_model(model_id)
+    except KeyError:
+        return JsonResponse({'error': 'Unknown model'}, status=404)
+
+    if samples.empty:
+        predictions = []
+    else:
+        predictions = training.predict(model, samples).tolist()
+    return JsonResponse({'model_id': str(model_id), 'predictions': predictions})
+
+
+def _model_id(value):
+    """
+    The canonical form of a model id taken from a request; KeyError unless
+    it is a UUID, so it can never name another file of the model store.
+    """
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        raise KeyError(value) from None
+
+
+def _fetch_query_dataframe(query_id, disease, pinned=False):
     """
     Run the catalog query with id=query_id (expects only {disease}),
     fan it out to all endpoints, collect the SELECT bindings,
-    and return a pandas.DataFrame of the results.
+    and return a pandas.DataFrame of the results (patient rows, or
+    per-group aggregates for the ageOnStats template).
+    A complete earlier fan-out is served from the frame cache (whatever
+    its age if `pinned` to the requesting session).
     """
-    entries = catalog()
-    entry   = entries[int(query_id)]
+    entry = by_id(query_id)
+    params = {"disease": disease}
+    endpoints = list(Endpoint.objects.all())
+    with _frame_flight(entry, params, endpoints, pinned=pinned) as (key, df):
+        if df is not None:
+            print("TRAIN_MODEL:", len(df), "rows from the frame cache")
+            return df.drop(columns='logo_url', errors='ignore')
+        df, complete = _fan_out_dataframe(entry, disease, endpoints)
+        if complete:
+            _cache_frame(key, df)
+    print("TRAIN_MODEL: built DataFrame with columns:", df.columns.tolist(),
+          "and", len(df), "rows")
+    return df
+
 
+def _fan_out_dataframe(entry, disease, endpoints):
+    """(merged frame of a training fan-out, whether every endpoint answered)."""
     # 1) Grab the raw template
     raw_template = entry['template']
 
@@ -651,44 +881,24 @@ def _fetch_query_dataframe(query_id, disease):
     # (for debugging—log this)
     print("TRAIN_MODEL SPARQL:\n", sparql)
 
-    # 3) Mask the template markers *locally* for the POST body
-    masked_template = raw_template.replace("<{", "**<").replace("}>", ">**")
-
-    rows = []
-    for ep in Endpoint.objects.all():
-        url = ep.url.rstrip("/") + "/sparql-protected/"
-        try:
-            resp = requests.post(
-                url,
-                data=urllib.parse.urlencode({
-                    "template": masked_template,
-                    "query":    sparql
-                }, quote_via=urllib.parse.quote),
-                headers={
-                    "Accept": "application/sparql-results+json",
-                    "Content-Type": "application/x-www-form-urlencoded; charset=utf-8"
-                },
-                timeout=5
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            # (for debugging—log the first endpoint’s JSON)
-            print(f"TRAIN_MODEL raw response from {ep.name}:", data)
-
-            # Only handle SELECT-style bindings
-            head = data.get("head", {}).get("vars", [])
-            for bd in data.get("results", {}).get("bindings", []):
-                # Extract each bound variable
-                row = {v: bd[v]["value"] for v in head if v in bd}
-                row["endpoint"] = ep.name
-                rows.append(row)
-
-        except Exception as ex:
+    # level-6 row dumps can be large: optionally parse them binding by binding
+    # straight into columns instead of decoding whole JSON documents
+    stream = getattr(settings, 'FEDERATION_STREAM_PARSE', False)
+    parts = []
+    failed = False
+    for res in fan_out(endpoints, raw_template, sparql,
+                       entry=entry, params={"disease": disease},
+                       parse=columnar.read_frame if stream else None):
+        ep = res.endpoint
+        if not res.ok:
             # log failures
-            print(f"TRAIN_MODEL: endpoint {ep.name} failed with {ex}")
+            print(f"TRAIN_MODEL: endpoint {ep.name} failed with {res.error}")
+            failed = True
             continue
+        # Only handle SELECT-style bindings
+        frame = res.data if stream else columnar.frame_from_sparql(res.data)
+        print(f"TRAIN_MODEL: {len(frame)} rows from {ep.name}")
+        parts.append((ep.name, None, frame))
 
-    df = pd.DataFrame(rows)
-    print("TRAIN_MODEL: built DataFrame with columns:", df.columns.tolist(),
-          "and", len(df), "rows")
-    return df
\ No newline at end of file
+    df = columnar.merge(parts).drop(columns='logo_url', errors='ignore')
+    return df, bool(parts) and not failed
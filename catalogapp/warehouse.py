@@ -0,0 +1,302 @@
+# catalogapp/warehouse.py
+"""
+Local DuckDB warehouse of federated query history.
+
+Every answer an endpoint sends back to a catalog query is appended to
+WAREHOUSE_DB (a DuckDB file next to ALLOWED_DB):
+  • `fetches` – one row per answer: template hash, catalog id, endpoint,
+    parameters (JSON), fetched_at, number of rows
+  • `q<id>`   – one table per catalog template, its variables as typed
+    columns plus fetch_id, template_hash, endpoint, params and fetched_at
+so past results can be aggregated with plain SQL (GROUP BY endpoint, time
+windows, …) without querying the nodes again; see `Warehouse.query`.
+
+Answers are queued by the fan-out and written by a background thread,
+which converts each batch to one Arrow table per template and inserts it
+with a single INSERT … SELECT, never row by row. DuckDB lets one process
+at a time open the file, so every worker process opens it only for one
+batch or one query and closes it right after; one that finds it held
+retries for up to WAREHOUSE_LOCK_TIMEOUT seconds (see `_open`).
+"""
+import atexit
+import decimal
+import queue
+from contextlib import closing, contextmanager
+import threading
+import time
+import uuid
+
+import pandas as pd
+from django.conf import settings
+
+from . import columnar
+from .cache import normalize_params
+from .queries import by_hash
+
+FETCH_COLUMNS = ['fetch_id', 'template_hash', 'endpoint', 'params', 'fetched_at']
+FETCHES_TABLE = """
+    CREATE TABLE IF NOT EXISTS fetches (
+        fetch_id      VARCHAR PRIMARY KEY,
+        template_hash VARCHAR,
+        query_id      INTEGER,
+        endpoint      VARCHAR,
+        params        VARCHAR,
+        fetched_at    TIMESTAMPTZ,
+        n_rows        BIGINT
+    )
+"""
+
+
+class WarehouseBusy(Exception):
+    """Another process kept the warehouse file open longer than the lock timeout."""
+
+
+def table_name(entry):
+    return f"q{entry['id']}"
+
+
+def answer_frame(data):
+    """
+    An endpoint's answer as a frame: SELECT bindings, an ASK boolean, or a
+    plain JSON object (delegated analytics); None for anything else.
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+    if not isinstance(data, dict):
+        return None
+    if 'head' in data and 'results' in data:
+        return columnar.frame_from_sparql(data)
+    if 'boolean' in data:
+        return pd.DataFrame({'boolean': [bool(data['boolean'])]})
+    if 'results' in data:   # known template, no results
+        return None
+    return pd.DataFrame([data])
+
+
+class Warehouse:
+
+    def __init__(self, path, max_queue=1000, lock_timeout=10):
+        import duckdb   # noqa: F401 – fail early when it is missing
+        import pyarrow  # noqa: F401
+
+        self.path = path
+        self.lock_timeout = lock_timeout
+        # the open connection, shared by this process's threads while any uses it
+        self._con, self._users, self._con_lock = None, 0, threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._writer, name='warehouse', daemon=True).start()
+        # don't drop queued answers, or kill the writer mid-insert, on shutdown
+        atexit.register(self.flush)
+
+    @contextmanager
+    def _open(self):
+        """
+        A cursor on the file, which stays open only while some thread of
+        this process uses it; waits while another process has the file open
+        (WarehouseBusy after `lock_timeout` seconds).
+        """
+        with self._con_lock:
+            if self._con is None:
+                self._con = self._connect()
+            self._users += 1
+        try:
+            with closing(self._con.cursor()) as cursor:
+                yield cursor
+        finally:
+            with self._con_lock:
+                self._users -= 1
+                if not self._users:
+                    self._con.close()
+                    self._con = None
+
+    def _connect(self):
+        import duckdb
+
+        deadline, pause = time.monotonic() + self.lock_timeout, 0.01
+        while True:
+            try:
+                # no file system access from SQL: ad-hoc queries only see the warehouse
+                con = duckdb.connect(self.path, config={'enable_external_access': False})
+                break
+            except duckdb.IOException as ex:
+                if time.monotonic() + pause > deadline:
+                    raise WarehouseBusy(str(ex)) from None
+            time.sleep(pause)
+            pause = min(pause * 2, 0.5)
+        con.execute(FETCHES_TABLE)
+        return con
+
+    # ---- ingestion ---------------------------------------------------------
+
+    def record(self, entry, params, endpoint_name, data):
+        """Queue one endpoint's answer to `entry` instantiated with `params`."""
+        try:
+            self._queue.put_nowait((entry['hash'], normalize_params(params),
+                                    endpoint_name, time.time(), data))
+        except queue.Full:
+            print(f"WAREHOUSE: queue full, answer of {endpoint_name} not recorded")
+
+    def flush(self):
+        """Wait until every queued answer is written."""
+        self._queue.join()
+
+    def _writer(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                while True:
+                    try:
+                        with self._open() as con:
+                            self._ingest(con, batch)
+                        break
+                    except WarehouseBusy:
+                        # e.g. a long ad-hoc query elsewhere: keep the batch, answers queue up
+                        print("WAREHOUSE: file busy, retrying", len(batch), "answers")
+            except Exception as ex:   # keep the writer alive whatever the batch held
+                print("WAREHOUSE: failed to record", len(batch), "answers:", ex)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _ingest(self, con, batch):
+        import pyarrow as pa
+
+        fetches, frames = [], {}
+        for template_hash, params, endpoint, fetched_at, data in batch:
+            entry = by_hash(template_hash)
+            frame = answer_frame(data)
+            fetch_id = str(uuid.uuid4())
+            when = pd.Timestamp(fetched_at, unit='s', tz='UTC')
+            fetches.append({
+                'fetch_id': fetch_id, 'template_hash': template_hash,
+                'query_id': entry['id'] if entry else None, 'endpoint': endpoint,
+                'params': params, 'fetched_at': when,
+                'n_rows': len(frame) if frame is not None else 0,
+            })
+            if entry is not None and frame is not None and len(frame):
+                frame = frame.drop(columns=[c for c in FETCH_COLUMNS if c in frame.columns])
+                meta = pd.DataFrame({'fetch_id': fetch_id, 'template_hash': template_hash,
+                                     'endpoint': endpoint, 'params': params,
+                                     'fetched_at': when}, index=frame.index)
+                frames.setdefault(table_name(entry), []).append(pd.concat([meta, frame], axis=1))
+
+        self._append(con, 'fetches', pa.Table.from_pandas(pd.DataFrame(fetches), preserve_index=False))
+        for table, parts in frames.items():
+            try:
+                arrow = pa.Table.from_pandas(pd.concat(parts, ignore_index=True), preserve_index=False)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as ex:
+                print(f"WAREHOUSE: {table} answers not recorded:", ex)
+                continue
+            self._append(con, table, arrow)
+
+    def _append(self, con, table, arrow):
+        """One bulk INSERT of an Arrow table, creating the table or its new columns first."""
+        con.register('batch', arrow)
+        try:
+            con.execute(f'CREATE TABLE IF NOT EXISTS "{table}" AS SELECT * FROM batch LIMIT 0')
+            existing = {row[0] for row in con.execute(f'DESCRIBE "{table}"').fetchall()}
+            for name, kind, *_ in con.execute('DESCRIBE SELECT * FROM batch').fetchall():
+                if name not in existing:
+                    con.execute(f'ALTER TABLE "{table}" ADD COLUMN "{name}" {kind}')
+            con.execute(f'INSERT INTO "{table}" BY NAME SELECT * FROM batch')
+        finally:
+            con.unregister('batch')
+
+    # ---- ad-hoc SQL --------------------------------------------------------
+
+    def tables(self):
+        """{table: [(column, type), …]} of the warehouse; may raise WarehouseBusy."""
+        out = {}
+        with self._open() as con:
+            columns = con.execute("""
+                SELECT table_name, column_name, data_type FROM information_schema.columns
+                WHERE table_schema = 'main' ORDER BY table_name, ordinal_position
+            """).fetchall()
+        for table, column, kind in columns:
+            out.setdefault(table, []).append((column, kind))
+        return out
+
+    def query(self, sql, max_rows=10000, timeout=30):
+        """
+        Run one read-only SELECT: (columns, rows, truncated). Raises
+        ValueError for anything else, or when it runs longer than `timeout`;
+        WarehouseBusy when the file can't be opened.
+        """
+        with self._open() as con:
+            return self._query(con, sql, max_rows, timeout)
+
+    def _query(self, con, sql, max_rows, timeout):
+        import duckdb
+
+        try:
+            statements = con.extract_statements(sql)
+        except duckdb.Error as ex:
+            raise ValueError(str(ex)) from None
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            raise ValueError("Only a single SELECT statement is allowed")
+
+        timer = threading.Timer(timeout, con.interrupt)
+        timer.start()
+        try:
+            # through Arrow: only the rows returned are turned into Python values
+            reader = con.execute(sql).to_arrow_reader(min(max_rows + 1, 100000))
+            columns, rows = reader.schema.names, []
+            for batch in reader:
+                rows.extend(tuple(row.values()) for row in batch.to_pylist())
+                if len(rows) > max_rows:
+                    break
+        except duckdb.InterruptException:
+            raise ValueError(f"Query interrupted after {timeout} s") from None
+        except duckdb.Error as ex:
+            raise ValueError(str(ex)) from None
+        finally:
+            timer.cancel()
+        return columns, [[_plain(v) for v in row] for row in rows[:max_rows]], len(rows) > max_rows
+
+
+def _plain(value):
+    """JSON-friendly form of a DuckDB value."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+_warehouse      = None
+_warehouse_lock = threading.Lock()
+_unavailable    = False
+
+
+def get_warehouse():
+    """
+    The process-wide Warehouse at WAREHOUSE_DB, or None when it is disabled
+    (WAREHOUSE_DB = '') or duckdb / pyarrow are missing.
+    """
+    global _warehouse, _unavailable
+    path = getattr(settings, 'WAREHOUSE_DB', None)
+    if not path or _unavailable:
+        return None
+    with _warehouse_lock:
+        if _warehouse is None and not _unavailable:
+            try:
+                _warehouse = Warehouse(path, getattr(settings, 'WAREHOUSE_MAX_QUEUE', 1000),
+                                       getattr(settings, 'WAREHOUSE_LOCK_TIMEOUT', 10))
+            except ImportError as ex:
+                print("WAREHOUSE: disabled:", ex)
+                _unavailable = True
+        return _warehouse
+
+
+def record(entry, params, endpoint_name, data):
+    """Record one endpoint's answer, when the warehouse is enabled."""
+    warehouse = get_warehouse()
+    if warehouse is not None:
+        warehouse.record(entry, params, endpoint_name, data)
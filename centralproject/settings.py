@@ -55,6 +55,106 @@ ALLOWED_DB   = os.path.join(MEDIA_ROOT, 'allowed_queries.duckdb')
 # Central’s own endpoints list
 ENDPOINTS_DB = os.path.join(MEDIA_ROOT, 'endpoints.duckdb')
 
+# Federated fan-out: how many endpoint calls may be in flight at once
+# (shared by all requests of this process) and the per-call timeout in seconds
+FEDERATION_MAX_WORKERS = int(os.getenv('FEDERATION_MAX_WORKERS', 16))
+FEDERATION_TIMEOUT     = float(os.getenv('FEDERATION_TIMEOUT', 5))
+# Keep-alive connection pool per endpoint, retried with exponential backoff
+# on connection errors and 502/503/504
+FEDERATION_POOL_SIZE   = int(os.getenv('FEDERATION_POOL_SIZE', 4))
+FEDERATION_RETRIES     = int(os.getenv('FEDERATION_RETRIES', 2))
+FEDERATION_BACKOFF     = float(os.getenv('FEDERATION_BACKOFF', 0.3))
+# Response decoding: 'auto' picks the fastest installed JSON library
+# (orjson, ujson, else json). FEDERATION_STREAM_PARSE parses training row dumps
+# incrementally with ijson: ~4x less memory, but slower and bypasses the result cache
+FEDERATION_JSON_DECODER = os.getenv('FEDERATION_JSON_DECODER', 'auto')
+FEDERATION_STREAM_PARSE = os.getenv('FEDERATION_STREAM_PARSE', 'False') == 'True'
+# Dispatch AVG projections as SUM + COUNT pairs and merge them into exact
+# global means (nodes must accept the rewritten template); per request with rewrite_avg=1/0
+FEDERATION_REWRITE_AVG = os.getenv('FEDERATION_REWRITE_AVG', 'False') == 'True'
+# Single flight: identical endpoint calls made while one is in flight join it
+# instead of being sent again (within a worker process)
+FEDERATION_SINGLE_FLIGHT = os.getenv('FEDERATION_SINGLE_FLIGHT', 'True') == 'True'
+
+# Circuit breaker per endpoint: open after N consecutive failures, retry after
+# the reset timeout; per-call timeouts adapt to FACTOR × the p95 latency observed
+# for the same template (between BREAKER_MIN_TIMEOUT and FEDERATION_TIMEOUT)
+# once enough calls of it were seen
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 3))
+BREAKER_RESET_TIMEOUT     = float(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+BREAKER_TIMEOUT_FACTOR    = float(os.getenv('BREAKER_TIMEOUT_FACTOR', 4))
+BREAKER_MIN_TIMEOUT       = float(os.getenv('BREAKER_MIN_TIMEOUT', 1))
+BREAKER_MIN_SAMPLES       = 10
+BREAKER_WINDOW            = 50
+
+# Cache of per-endpoint answers: 'memory', 'duckdb' (a file next to ALLOWED_DB,
+# survives restarts) or '' to disable. TTLs are in seconds, per template level.
+RESULT_CACHE_BACKEND     = os.getenv('RESULT_CACHE_BACKEND', 'memory')
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 1000))
+RESULT_CACHE_TTL = {
+    0: 3600, 1: 3600, 2: 3600,   # aggregates
+    3: 900,  4: 900,
+    5: 300,  6: 300,             # row dumps
+}
+
+# Cache of merged federated DataFrames (complete fan-outs) shared by the query,
+# analytics and training views, as memory-mapped Arrow files: how long they are
+# fresh (seconds; a session keeps reusing the ones it already used), the disk
+# budget in bytes (0 disables it) and how many frames a session pins
+FRAME_CACHE_DIR         = os.path.join(MEDIA_ROOT, 'frames')
+FRAME_CACHE_TTL         = int(os.getenv('FRAME_CACHE_TTL', 300))
+FRAME_CACHE_MAX_BYTES   = int(os.getenv('FRAME_CACHE_MAX_BYTES', 1 << 30))
+FRAME_CACHE_SESSION_MAX = 32
+# Across worker processes: a worker fetching a frame holds a lock file, and
+# identical fan-outs in other workers wait for it and read the cached frame
+FRAME_CACHE_SINGLE_FLIGHT = os.getenv('FRAME_CACHE_SINGLE_FLIGHT', 'False') == 'True'
+
+# Query results are paged from the frame cache: rows per page fetched by the
+# virtual-scrolling table (also shown when the cache is off), and the largest page
+RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', 100))
+RESULTS_PAGE_MAX  = int(os.getenv('RESULTS_PAGE_MAX', 1000))
+
+# Warehouse of every endpoint answer (DuckDB, '' disables it), written in the
+# background; ad-hoc SELECTs at /catalog/warehouse/ return at most MAX_ROWS rows
+# and are interrupted after QUERY_TIMEOUT seconds. Each process opens the file
+# per batch or query, waiting up to LOCK_TIMEOUT seconds while another has it
+WAREHOUSE_DB            = os.getenv('WAREHOUSE_DB', os.path.join(MEDIA_ROOT, 'warehouse.duckdb'))
+WAREHOUSE_MAX_QUEUE     = int(os.getenv('WAREHOUSE_MAX_QUEUE', 1000))
+WAREHOUSE_MAX_ROWS      = int(os.getenv('WAREHOUSE_MAX_ROWS', 10000))
+WAREHOUSE_QUERY_TIMEOUT = float(os.getenv('WAREHOUSE_QUERY_TIMEOUT', 30))
+WAREHOUSE_LOCK_TIMEOUT  = float(os.getenv('WAREHOUSE_LOCK_TIMEOUT', 10))
+
+# Exports (/catalog/query/export/) are streamed in chunks of EXPORT_CHUNK_ROWS
+# rows; at most EXPORT_QUEUE_CHUNKS parsed chunks wait for a slow client, and
+# endpoints are called by a pool of EXPORT_MAX_WORKERS threads of their own
+EXPORT_CHUNK_ROWS   = int(os.getenv('EXPORT_CHUNK_ROWS', 10000))
+EXPORT_QUEUE_CHUNKS = int(os.getenv('EXPORT_QUEUE_CHUNKS', 4))
+EXPORT_MAX_WORKERS  = int(os.getenv('EXPORT_MAX_WORKERS', 8))
+
+# Background endpoint health checks: seconds between rounds (0 disables the
+# monitor), per-probe timeout, and how many recent probes feed the percentiles
+HEALTH_CHECK_INTERVAL = int(os.getenv('HEALTH_CHECK_INTERVAL', 60))
+HEALTH_CHECK_TIMEOUT  = float(os.getenv('HEALTH_CHECK_TIMEOUT', 2))
+HEALTH_CHECK_WINDOW   = 50
+
+# Background training: worker processes (and runner threads), and where
+# fitted models are saved
+TRAINING_WORKERS = int(os.getenv('TRAINING_WORKERS', os.cpu_count() or 2))
+MODEL_DIR        = os.path.join(BASE_DIR, 'data', 'models')
+# Feature encoder fitted and saved with each model: 'onehot' or 'ordinal';
+# one-hot features may be kept as a scipy sparse matrix
+TRAINING_ENCODER         = os.getenv('TRAINING_ENCODER', 'onehot')
+TRAINING_SPARSE_FEATURES = os.getenv('TRAINING_SPARSE_FEATURES', 'False') == 'True'
+# Fitted models kept deserialized per process (LRU, entries / seconds),
+# and on disk (oldest deleted first)
+MODEL_STORE_MAX_MEMORY = int(os.getenv('MODEL_STORE_MAX_MEMORY', 16))
+MODEL_STORE_TTL        = int(os.getenv('MODEL_STORE_TTL', 3600))
+MODEL_STORE_MAX_DISK   = int(os.getenv('MODEL_STORE_MAX_DISK', 200))
+# Largest hyperparameter search (number of cross-validated configurations)
+TRAINING_SEARCH_MAX_CANDIDATES = int(os.getenv('TRAINING_SEARCH_MAX_CANDIDATES', 200))
+
+# Largest number of samples accepted by one batch prediction request
+PREDICT_BATCH_MAX_ROWS = int(os.getenv('PREDICT_BATCH_MAX_ROWS', 100000))
 
 DATABASES = {
     'default': {